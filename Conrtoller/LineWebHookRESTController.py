@@ -1,6 +1,5 @@
 from flask import Blueprint, request, jsonify
 import logging
-import requests
 import json
 import os
 import time
@@ -15,7 +14,8 @@ from Service.OptimizedErrorHandler import OptimizedErrorHandler
 from Service.SimpleCache import app_cache, nlp_cache, image_cache, user_cache
 from Service.AsyncProcessor import async_processor
 from Service.UnifiedResponseService import unified_response_service
-from config.line_config import lineToken, getContentURL, sendReplyMessageUrl
+from Service.HttpClient import http_session, DEFAULT_TIMEOUT
+from config.line_config import lineToken, content_url, sendReplyMessageUrl, sendPushMessageUrl
 
 # 創建藍圖
 line_webhook_bp = Blueprint('line_webhook', __name__, url_prefix='/api/v1')
@@ -24,6 +24,10 @@ line_join_service = LineJoinService()
 # 設置日誌記錄
 logger = logging.getLogger(__name__)
 
+# 儲存用戶上傳圖片與音訊的目錄
+IMAGE_DIR = Path('static/images')
+AUDIO_DIR = Path('static/audio')
+
 # 事件去重機制 - 用於追蹤已處理的事件
 class EventDeduplicator:
     def __init__(self, max_size=1000, expire_time=300):  # 5分鐘過期
@@ -121,6 +125,9 @@ class LineMessageHandler:
         self.image_process_service = get_image_process_service()
         self.manager_cal_service = get_manager_cal_service()
         self.food_data_service = get_food_data_service()
+        # 建立儲存圖片與音訊的目錄（只需建立一次）
+        IMAGE_DIR.mkdir(parents=True, exist_ok=True)
+        AUDIO_DIR.mkdir(parents=True, exist_ok=True)
         # 初始化優化的錯誤處理器
         self.error_handler = OptimizedErrorHandler(__name__)
         
@@ -168,47 +175,91 @@ class LineMessageHandler:
         if not text or not user_id:
             return
         
-        # 使用統一響應服務處理
-        response = unified_response_service.process_message(user_id, text)
-        if response:
-            if reply_token:
-                self.send_reply(reply_token, [{
-                    'type': 'text',
-                    'text': response['result']
-                }])
-            return
-        
-        # 3. 檢查快取
-        cache_key = f"nlp_{user_id}_{text}"
-        cached_response = nlp_cache.get(cache_key)
-        if cached_response:
+        # 使用統一響應服務或快取回覆
+        quick_reply = self._get_quick_text_reply(user_id, text)
+        if quick_reply:
             if reply_token:
                 self.send_reply(reply_token, [{
                     'type': 'text',
-                    'text': cached_response
+                    'text': quick_reply
                 }])
             return
         
-        # 4. 異步處理 NLP
+        # 異步處理 NLP
         try:
             nlp_response = self.nlp_service.nlpProcess(user_id, text)
-            
-            if 'result' in nlp_response and reply_token:
-                response_text = nlp_response['result']
-                # 快取結果
-                nlp_cache.set(cache_key, response_text)
-                
-                self.send_reply(reply_token, [{
-                    'type': 'text',
-                    'text': response_text
-                }])
+            self._reply_nlp_response(user_id, text, reply_token, nlp_response)
         except Exception as e:
             logger.error(f"NLP處理錯誤: {str(e)}")
-            if reply_token:
+            self._reply_nlp_error(user_id, reply_token)
+    
+    @OptimizedErrorHandler(logger_name=__name__).fast_error_handler("抱歉，處理您的訊息時發生錯誤")
+    def handle_text_events_batch(self, events):
+        """
+        批次處理同一次 Webhook 送達的多則文字訊息
+        需要 NLP 的訊息合併為一次批次呼叫，由 nlpService 並行送出 Gemini 請求
+        """
+        pending = []
+        for event in events:
+            user_id = event.get('source', {}).get('userId')
+            reply_token = event.get('replyToken')
+            text = event.get('message', {}).get('text', '')
+            if not user_id or not reply_token or not text:
+                logger.warning(f"文字訊息事件缺少必要資訊，跳過處理: {event}")
+                continue
+            
+            quick_reply = self._get_quick_text_reply(user_id, text)
+            if quick_reply:
                 self.send_reply(reply_token, [{
                     'type': 'text',
-                    'text': "抱歉，處理您的訊息時發生錯誤，請稍後再試。"
+                    'text': quick_reply
                 }])
+                continue
+            
+            pending.append((user_id, text, reply_token))
+        
+        if not pending:
+            return None
+        
+        try:
+            nlp_responses = self.nlp_service.nlpProcess_batch([(user_id, text) for user_id, text, _ in pending])
+        except Exception as e:
+            logger.error(f"批次NLP處理錯誤: {str(e)}")
+            for user_id, _, reply_token in pending:
+                self._reply_nlp_error(user_id, reply_token)
+            return None
+        
+        for (user_id, text, reply_token), nlp_response in zip(pending, nlp_responses):
+            self._reply_nlp_response(user_id, text, reply_token, nlp_response)
+        return None
+    
+    def _get_quick_text_reply(self, user_id, text):
+        """取得不需呼叫 NLP 的回覆（統一響應服務或快取），沒有則返回 None"""
+        response = unified_response_service.process_message(user_id, text)
+        if response:
+            return response['result']
+        
+        return nlp_cache.get(f"nlp_{user_id}_{text}")
+    
+    def _reply_nlp_response(self, user_id, text, reply_token, nlp_response):
+        """快取並回覆 NLP 處理結果"""
+        if nlp_response and 'result' in nlp_response and reply_token:
+            response_text = nlp_response['result']
+            # 快取結果
+            nlp_cache.set(f"nlp_{user_id}_{text}", response_text)
+            
+            self.send_reply(reply_token, [{
+                'type': 'text',
+                'text': response_text
+            }], user_id=user_id)
+    
+    def _reply_nlp_error(self, user_id, reply_token):
+        """NLP 處理失敗時回覆錯誤訊息（處理太久導致 replyToken 失效時改用推播）"""
+        if reply_token:
+            self.send_reply(reply_token, [{
+                'type': 'text',
+                'text': "抱歉，處理您的訊息時發生錯誤，請稍後再試。"
+            }], user_id=user_id)
     
     # 註解掉的舊方法 - 已被 _handle_text_message_fast 取代
     # def _handle_text_message(self, event, reply_token):
@@ -243,8 +294,11 @@ class LineMessageHandler:
          
                     
     # 送回覆訊息給使用者             
-    def send_reply(self, reply_token, messages):
-        """發送回覆訊息給使用者"""
+    def send_reply(self, reply_token, messages, user_id=None):
+        """
+        發送回覆訊息給使用者
+        提供 user_id 時，replyToken 已失效（例如處理太久而逾時）會改用推播送出
+        """
         try:
             # 檢查 reply_token 是否有效
             if not reply_token:
@@ -262,18 +316,22 @@ class LineMessageHandler:
             
             logger.info(f"發送回覆訊息: 目標token={reply_token[:10]}..., 訊息數量={len(messages)}")
             
-            response = requests.post(
+            response = http_session.post(
                 sendReplyMessageUrl,
                 headers=self.headers,
-                data=json.dumps(data)
+                data=json.dumps(data),
+                timeout=DEFAULT_TIMEOUT
             )
             
             if response.status_code == 200:
                 logger.info("回覆訊息發送成功")
                 return True
-            elif response.status_code == 400:
+            elif response.status_code == 400 and self._is_invalid_reply_token(response):
                 # replyToken 已被使用或無效
                 logger.warning(f"replyToken 無效或已使用: {response.status_code}, {response.text}")
+                if user_id:
+                    logger.info("改用推播訊息送出回覆")
+                    return self.send_push(user_id, messages)
                 return False
             else:
                 logger.error(f"發送回覆訊息失敗: {response.status_code}, {response.text}")
@@ -282,25 +340,61 @@ class LineMessageHandler:
         except Exception as e:
             logger.error(f"發送回覆訊息時發生錯誤: {str(e)}")
             return False
+    
+    @staticmethod
+    def _is_invalid_reply_token(response):
+        """檢查 400 回應是否為 replyToken 無效（其他驗證錯誤改用推播也會以相同原因失敗）"""
+        try:
+            message = response.json().get('message', '')
+        except ValueError:
+            return False
+        return 'invalid reply token' in str(message).lower()
+    
+    def send_push(self, user_id, messages):
+        """主動推播訊息給使用者（用於 replyToken 已使用後的後續訊息）"""
+        try:
+            if not user_id:
+                logger.warning("嘗試推播訊息給空的 user_id")
+                return False
+            
+            if not isinstance(messages, list):
+                messages = [messages]
+            
+            data = {
+                'to': user_id,
+                'messages': messages
+            }
+            
+            response = http_session.post(
+                sendPushMessageUrl,
+                headers=self.headers,
+                data=json.dumps(data),
+                timeout=DEFAULT_TIMEOUT
+            )
+            
+            if response.status_code == 200:
+                logger.info("推播訊息發送成功")
+                return True
+            logger.error(f"推播訊息失敗: {response.status_code}, {response.text}")
+            return False
+        
+        except Exception as e:
+            logger.error(f"推播訊息時發生錯誤: {str(e)}")
+            return False
         
     def _handle_image_message(self, event, user_id, reply_token):
         """處理圖片訊息"""
         message_id = event.get('message', {}).get('id')
         
-        # 建立儲存圖片的目錄
-        image_dir = Path('static/images')
-        image_dir.mkdir(parents=True, exist_ok=True)
-        
         # 取得該使用者現有的圖片數量作為序號
-        existing_files = list(image_dir.glob(f'{user_id}-*.jpg'))
+        existing_files = list(IMAGE_DIR.glob(f'{user_id}-*.jpg'))
         sequence_number = len(existing_files) + 1
         
         # 組合檔案路徑
-        file_path = image_dir / f'{user_id}-{sequence_number}.jpg'
+        file_path = IMAGE_DIR / f'{user_id}-{sequence_number}.jpg'
         
         # 從 LINE 平台下載圖片
-        content_url = getContentURL.format(messageId=message_id)
-        response = requests.get(content_url, headers=self.headers)
+        response = http_session.get(content_url(message_id), headers=self.headers, timeout=DEFAULT_TIMEOUT)
         
         if response.status_code == 200:
             # 儲存圖片
@@ -308,7 +402,8 @@ class LineMessageHandler:
                 f.write(response.content)
             
             # 使用 ImageProcessService 處理圖片
-            image_analysis = self.image_process_service.imageParse(str(file_path))
+            # 直接傳入下載的圖片內容，避免寫入後再從磁碟讀回
+            image_analysis = self.image_process_service.imageParse(str(file_path), response.content)
             
             # 將圖片分析結果存入資料庫
             # 使用文件名稱(不含副檔名)作為 master_id
@@ -380,7 +475,15 @@ class LineMessageHandler:
                         # 將圖片分析結果傳遞給 nlpService 進行進一步處理
                         try:
                             logger.info(f"將圖片分析結果傳遞給 nlpService 進行進一步處理")
-                            enhanced_analysis = self.nlp_service.process_image_analysis(user_id, processed_analysis)
+                            if self.nlp_service.defer_image_suggestion:
+                                # 先回覆分析結果，營養建議產生後再推播給用戶
+                                enhanced_analysis = self.nlp_service.process_image_analysis_fast(
+                                    user_id,
+                                    processed_analysis,
+                                    lambda suggestion: self.send_push(user_id, [{'type': 'text', 'text': suggestion}])
+                                )
+                            else:
+                                enhanced_analysis = self.nlp_service.process_image_analysis(user_id, processed_analysis)
                             
                             if enhanced_analysis and 'result' in enhanced_analysis:
                                 # 使用增強後的回覆訊息
@@ -391,7 +494,7 @@ class LineMessageHandler:
                                     self.send_reply(reply_token, [{
                                         'type': 'text',
                                         'text': formatted_message
-                                    }])
+                                    }], user_id=user_id)
                                 return  # 結束處理，避免重複回覆
                             else:
                                 logger.warning(f"nlpService 返回的結果無效或沒有 result 字段: {enhanced_analysis}")
@@ -433,7 +536,7 @@ class LineMessageHandler:
                 self.send_reply(reply_token, [{
                     'type': 'text',
                     'text': formatted_message
-                }])
+                }], user_id=user_id)
         else:
             #TODO 單向循環是否麻煩？
             # 下載圖片失敗，直接在控制器處理錯誤
@@ -451,20 +554,15 @@ class LineMessageHandler:
         """處理音訊訊息"""
         message_id = event.get('message', {}).get('id')
         
-        # 建立儲存音訊的目錄
-        audio_dir = Path('static/audio')
-        audio_dir.mkdir(parents=True, exist_ok=True)
-        
         # 取得該使用者現有的音訊數量作為序號
-        existing_files = list(audio_dir.glob(f'{user_id}-*.mp3'))
+        existing_files = list(AUDIO_DIR.glob(f'{user_id}-*.mp3'))
         sequence_number = len(existing_files) + 1
         
         # 組合檔案路徑
-        file_path = audio_dir / f'{user_id}-{sequence_number}.mp3'
+        file_path = AUDIO_DIR / f'{user_id}-{sequence_number}.mp3'
         
         # 從 LINE 平台下載音訊
-        content_url = getContentURL.format(messageId=message_id)
-        response = requests.get(content_url, headers=self.headers)
+        response = http_session.get(content_url(message_id), headers=self.headers, timeout=DEFAULT_TIMEOUT)
         
         if response.status_code == 200:
             # 儲存音訊
@@ -508,6 +606,7 @@ def line_webhook_handler():
         
     # 快速處理事件 - 加入去重檢查
     results = []
+    text_events = []
     for event in events:
         # 檢查是否為重複事件
         if event_deduplicator.is_duplicate(event):
@@ -533,8 +632,12 @@ def line_webhook_handler():
             # 確保 replyToken 存在且未被使用過
             reply_token = event.get('replyToken')
             if reply_token:
-                # 非阻塞處理訊息
-                line_message_handler.handle_message_event(event)
+                if event.get('message', {}).get('type') == 'text' and event.get('source', {}).get('userId'):
+                    # 文字訊息收集後批次處理
+                    text_events.append(event)
+                else:
+                    # 非阻塞處理訊息
+                    line_message_handler.handle_message_event(event)
                 results.append({"event_type": "message", "result": "處理中"})
             else:
                 logger.warning(f"訊息事件缺少 replyToken: {event}")
@@ -542,4 +645,10 @@ def line_webhook_handler():
         else:
             results.append({"status": "warning", "message": f"未知事件類型: {event_type}"})
     
+    # 同一次 Webhook 的文字訊息合併為一次批次 NLP 處理
+    if len(text_events) == 1:
+        line_message_handler.handle_message_event(text_events[0])
+    elif text_events:
+        line_message_handler.handle_text_events_batch(text_events)
+    
     return jsonify({"status": "success", "results": results}), 200
@@ -3,6 +3,7 @@
 """
 import asyncio
 import concurrent.futures
+import threading
 import time
 import logging
 from typing import Any, Callable, Dict, Optional
@@ -10,10 +11,59 @@ from functools import wraps
 
 logger = logging.getLogger(__name__)
 
+# uvloop 為選用套件（僅支援 Linux/macOS），安裝時背景事件迴圈改用 uvloop 以降低迴圈本身的開銷
+try:
+    import uvloop
+    _new_event_loop = uvloop.new_event_loop
+except ImportError:
+    _new_event_loop = asyncio.new_event_loop
+
 class AsyncProcessor:
-    def __init__(self, max_workers=3):
+    def __init__(self, max_workers=3, gemini_max_concurrency=8):
         self.max_workers = max_workers
         self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        # 同時送出的 Gemini 請求數上限，所有協程都在同一個背景事件迴圈上，共用此信號量即可限制全域並行數
+        self.gemini_semaphore = asyncio.Semaphore(gemini_max_concurrency)
+        # 背景事件迴圈 - 讓同步程式碼可以執行協程
+        self._loop = None
+        self._loop_lock = threading.Lock()
+        
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        """取得背景事件迴圈，首次使用時建立並在背景線程執行"""
+        if self._loop is None:
+            with self._loop_lock:
+                if self._loop is None:
+                    loop = _new_event_loop()
+                    threading.Thread(
+                        target=loop.run_forever,
+                        name="async-processor-loop",
+                        daemon=True
+                    ).start()
+                    self._loop = loop
+        return self._loop
+    
+    def run_coroutine(self, coro, timeout: Optional[float] = None) -> Any:
+        """
+        在共用的背景事件迴圈上執行協程，並同步等待結果
+        所有協程共用同一個事件迴圈，非同步客戶端不會綁定到不同的迴圈
+        """
+        future = asyncio.run_coroutine_threadsafe(coro, self._get_loop())
+        return future.result(timeout=timeout)
+    
+    def submit_coroutine(self, coro) -> concurrent.futures.Future:
+        """
+        將協程排入共用的背景事件迴圈後立即返回，不等待結果
+        用於回覆用戶後才需完成的工作（例如推播後續訊息）
+        """
+        future = asyncio.run_coroutine_threadsafe(coro, self._get_loop())
+        future.add_done_callback(self._log_background_error)
+        return future
+    
+    @staticmethod
+    def _log_background_error(future: concurrent.futures.Future) -> None:
+        """記錄背景協程未處理的例外"""
+        if not future.cancelled() and future.exception() is not None:
+            logger.error(f"背景協程執行錯誤: {future.exception()}")
         
     def async_decorator(self, timeout=30):
         """異步處理裝飾器"""
@@ -59,6 +109,8 @@ class AsyncProcessor:
     def shutdown(self):
         """關閉執行器"""
         self.executor.shutdown(wait=True)
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
 
 # 全域異步處理器
 async_processor = AsyncProcessor()
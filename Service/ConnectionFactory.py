@@ -7,7 +7,10 @@ import pyodbc
 import sys
 import os
 import logging
-from typing import List, Dict, Any, Optional, Tuple
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple, Callable
 from queue import Queue, Empty
 from threading import Lock
 import time
@@ -21,6 +24,9 @@ from config.dataBase import db_config
 # 設置日誌記錄
 logger = logging.getLogger(__name__)
 
+# 啟用 ODBC 驅動管理員層級的連接共用（須在建立第一個連接前設定）
+pyodbc.pooling = True
+
 class ConnectionPool:
     """
     連接池管理器 - 優化資料庫連接性能
@@ -41,8 +47,8 @@ class ConnectionPool:
         if hasattr(self, '_initialized') and self._initialized:
             return
             
-        self.max_connections = 5
-        self.min_connections = 2
+        self.max_connections = db_config.get('poolMaxSize', 5)
+        self.min_connections = db_config.get('poolMinSize', 2)
         self.connection_pool = Queue(maxsize=self.max_connections)
         self.active_connections = 0
         self.pool_lock = Lock()
@@ -59,36 +65,24 @@ class ConnectionPool:
     def _create_connection_string(self):
         """創建連接字串"""
         if db_config['driver'] == 'ODBC Driver 17 for SQL Server':
-            driver_path = '/opt/homebrew/lib/libmsodbcsql.17.dylib'
+            driver = '/opt/homebrew/lib/libmsodbcsql.17.dylib'
         elif db_config['driver'] == 'ODBC Driver 18 for SQL Server':
-            driver_path = '/opt/homebrew/lib/libmsodbcsql.18.dylib'
+            driver = '/opt/homebrew/lib/libmsodbcsql.18.dylib'
         else:
-            driver_path = None
+            driver = f"{{{db_config['driver']}}}"
             
-        if driver_path:
-            return (
-                f"DRIVER={driver_path};"
-                f"SERVER={db_config['serverName']};"
-                f"DATABASE={db_config['databaseName']};"
-                f"UID={db_config['userName']};"
-                f"PWD={db_config['password']};"
-                f"TrustServerCertificate=yes;"
-                f"Encrypt=yes;"
-                f"Connection Timeout={self.connection_timeout};"
-                f"Charset=UTF-8;"
-            )
-        else:
-            return (
-                f"DRIVER={{{db_config['driver']}}};"
-                f"SERVER={db_config['serverName']};"
-                f"DATABASE={db_config['databaseName']};"
-                f"UID={db_config['userName']};"
-                f"PWD={db_config['password']};"
-                f"TrustServerCertificate=yes;"
-                f"Encrypt=yes;"
-                f"Connection Timeout={self.connection_timeout};"
-                f"Charset=UTF-8;"
-            )
+        return (
+            f"DRIVER={driver};"
+            f"SERVER={db_config['serverName']};"
+            f"DATABASE={db_config['databaseName']};"
+            f"UID={db_config['userName']};"
+            f"PWD={db_config['password']};"
+            f"TrustServerCertificate=yes;"
+            f"Encrypt=yes;"
+            f"MARS_Connection=yes;"  # 同一連接可同時有多個未讀完的結果集
+            f"Connection Timeout={self.connection_timeout};"
+            f"Charset=UTF-8;"
+        )
     
     def _create_new_connection(self):
         """創建新的資料庫連接"""
@@ -192,6 +186,10 @@ class ConnectionPool:
 # 全域連接池實例
 _connection_pool = ConnectionPool()
 
+# 非同步程式碼的資料庫工作線程，數量與連接池上限相同，
+# 超過上限的查詢在執行器中排隊，而不是搶不到連接後逾時失敗
+_db_executor = ThreadPoolExecutor(max_workers=_connection_pool.max_connections, thread_name_prefix="db-worker")
+
 class ConnectionFactory:
     """
     優化的資料庫連接工廠類別
@@ -268,6 +266,37 @@ class ConnectionFactory:
             # 歸還連接
             _connection_pool.return_connection(connection)
     
+    @staticmethod
+    async def run_async(func: Callable, *args, **kwargs) -> Any:
+        """
+        在資料庫專用的工作線程執行會存取資料庫的同步函數，供非同步程式碼 await
+        同時執行的數量受連接池上限限制，不會阻塞事件迴圈
+        
+        Args:
+            func: 要執行的同步函數（例如資料服務的查詢方法）
+            *args, **kwargs: 傳給 func 的參數
+            
+        Returns:
+            func 的返回值
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_db_executor, functools.partial(func, *args, **kwargs))
+    
+    @staticmethod
+    async def execute_query_async(query, params=None, fetch_one=False):
+        """
+        非同步版本的 execute_query_fast
+        
+        Args:
+            query: SQL查詢語句
+            params: 查詢參數 (可選)
+            fetch_one: 是否只獲取一條記錄
+            
+        Returns:
+            result: 查詢結果
+        """
+        return await ConnectionFactory.run_async(ConnectionFactory.execute_query_fast, query, params, fetch_one)
+    
     @staticmethod
     def get_performance_stats():
         """獲取性能統計"""
@@ -0,0 +1,148 @@
+"""
+對話歷史儲存服務 - 提供程序內 LRU 與 Redis 兩種後端
+設定 redis.url（或環境變數 REDIS_URL）時使用 Redis，讓多個 worker 共用對話歷史
+"""
+import json
+import logging
+import os
+from collections import OrderedDict, deque
+from typing import Dict, Any, List
+
+logger = logging.getLogger(__name__)
+
+class InMemoryConversationStore:
+    """程序內的對話歷史儲存，超過用戶上限時淘汰最久未使用的對話"""
+
+    def __init__(self, max_users: int = 2000, max_messages: int = 20):
+        self._histories = OrderedDict()  # user_id -> deque[{"role", "parts"}]
+        self.max_users = max_users
+        self.max_messages = max_messages
+
+    async def load(self, user_id: str) -> List[Dict[str, Any]]:
+        """取得用戶的對話歷史，並標記為最近使用"""
+        history = self._histories.get(user_id)
+        if history is None:
+            return []
+        self._histories.move_to_end(user_id)
+        return list(history)
+
+    async def exists(self, user_id: str) -> bool:
+        """檢查用戶是否已有對話歷史"""
+        return user_id in self._histories
+
+    async def append(self, user_id: str, *messages: Dict[str, Any]) -> None:
+        """附加訊息到用戶的對話歷史，超過上限時捨棄最舊的訊息"""
+        history = self._histories.get(user_id)
+        if history is None:
+            history = deque(maxlen=self.max_messages)
+            self._histories[user_id] = history
+
+            # 超過用戶上限時淘汰最久未使用的對話
+            while len(self._histories) > self.max_users:
+                self._histories.popitem(last=False)
+        else:
+            self._histories.move_to_end(user_id)
+        history.extend(messages)
+
+    async def compact(self, user_id: str, older: List[Dict[str, Any]], summary_messages: List[Dict[str, Any]]) -> bool:
+        """
+        以摘要訊息取代對話開頭的舊訊息
+        開頭已不是 older（期間有新訊息推動）時不做處理並返回 False
+        """
+        history = self._histories.get(user_id)
+        if history is None or len(history) < len(older) or history[0] is not older[0]:
+            return False
+
+        for _ in range(len(older)):
+            history.popleft()
+        history.extendleft(reversed(summary_messages))
+        return True
+
+
+class RedisConversationStore:
+    """以 Redis list 儲存對話歷史，每則訊息為一個 JSON 字串"""
+
+    def __init__(self, url: str, max_messages: int = 20, ttl: int = 86400, key_prefix: str = "nlp:hist:"):
+        # 只有啟用 Redis 時才需要安裝 redis 套件
+        import redis.asyncio as redis_asyncio
+
+        self._redis = redis_asyncio.Redis.from_url(url, decode_responses=True)
+        self.max_messages = max_messages
+        self.ttl = ttl
+        self.key_prefix = key_prefix
+
+    def _key(self, user_id: str) -> str:
+        return f"{self.key_prefix}{user_id}"
+
+    @staticmethod
+    def _encode(message: Dict[str, Any]) -> str:
+        return json.dumps(message, ensure_ascii=False, separators=(",", ":"))
+
+    async def load(self, user_id: str) -> List[Dict[str, Any]]:
+        """取得用戶的對話歷史"""
+        raw_messages = await self._redis.lrange(self._key(user_id), 0, -1)
+        return [json.loads(raw) for raw in raw_messages]
+
+    async def exists(self, user_id: str) -> bool:
+        """檢查用戶是否已有對話歷史"""
+        return bool(await self._redis.exists(self._key(user_id)))
+
+    async def append(self, user_id: str, *messages: Dict[str, Any]) -> None:
+        """附加訊息並修剪至最近的訊息數，同時更新過期時間"""
+        key = self._key(user_id)
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.rpush(key, *(self._encode(message) for message in messages))
+            pipe.ltrim(key, -self.max_messages, -1)
+            pipe.expire(key, self.ttl)
+            await pipe.execute()
+
+    async def compact(self, user_id: str, older: List[Dict[str, Any]], summary_messages: List[Dict[str, Any]]) -> bool:
+        """
+        以摘要訊息取代對話開頭的舊訊息
+        開頭已不是 older（期間有新訊息推動）時不做處理並返回 False
+        以 WATCH 保護比對與取代，比對後其他 worker 修改了對話時放棄這次壓縮
+        """
+        from redis.exceptions import WatchError
+
+        key = self._key(user_id)
+        async with self._redis.pipeline(transaction=True) as pipe:
+            try:
+                await pipe.watch(key)
+                head = await pipe.lrange(key, 0, len(older) - 1)
+                if [json.loads(raw) for raw in head] != older:
+                    await pipe.unwatch()
+                    return False
+
+                pipe.multi()
+                pipe.ltrim(key, len(older), -1)
+                pipe.lpush(key, *(self._encode(message) for message in reversed(summary_messages)))
+                pipe.expire(key, self.ttl)
+                await pipe.execute()
+            except WatchError:
+                logger.info(f"對話歷史在壓縮期間被修改，略過本次壓縮: {user_id}")
+                return False
+        return True
+
+
+def create_conversation_store(config: Dict[str, Any], max_users: int = 2000, max_messages: int = 20):
+    """
+    依設定建立對話歷史儲存
+
+    Args:
+        config: get_config() 的內容，redis.url 有值時使用 Redis
+        max_users: 程序內儲存最多保留的用戶對話數
+        max_messages: 每個對話保留的最近訊息數
+
+    Returns:
+        對話歷史儲存實例
+    """
+    redis_url = os.getenv('REDIS_URL') or config.get('redis', {}).get('url')
+    if redis_url:
+        try:
+            store = RedisConversationStore(redis_url, max_messages=max_messages)
+            logger.info("對話歷史使用 Redis 儲存")
+            return store
+        except ImportError:
+            logger.warning("已設定 Redis 但未安裝 redis 套件，改用程序內儲存")
+
+    return InMemoryConversationStore(max_users=max_users, max_messages=max_messages)
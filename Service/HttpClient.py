@@ -0,0 +1,42 @@
+"""
+共用 HTTP 連線服務 - 重複使用 TCP/TLS 連線，避免每個請求重新握手
+"""
+import logging
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+# 對外 HTTP 請求的預設逾時（秒）
+DEFAULT_TIMEOUT = 30
+
+def create_http_session(pool_connections: int = 10, pool_maxsize: int = 100, retries: int = 2) -> requests.Session:
+    """
+    建立具連線池的 HTTP Session
+
+    Args:
+        pool_connections: 快取的主機連線池數量
+        pool_maxsize: 每個主機保留的最大連線數
+        retries: GET 請求遇到暫時性錯誤時的重試次數
+
+    Returns:
+        requests.Session: 可在多個線程間共用的 Session
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=pool_connections,
+        pool_maxsize=pool_maxsize,
+        max_retries=Retry(
+            total=retries,
+            backoff_factor=0.3,
+            status_forcelist=(500, 502, 503, 504),
+            allowed_methods=frozenset({"GET"})  # 回覆訊息等 POST 請求不可重送
+        )
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+# 全域共用的 HTTP Session
+http_session = create_http_session()
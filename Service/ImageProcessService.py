@@ -1,6 +1,8 @@
+import asyncio
 import logging
 import json
 import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
 import traceback
 from pathlib import Path
 from config import get_config
@@ -10,10 +12,50 @@ from Service.OptimizedErrorHandler import OptimizedErrorHandler
 from Service.SimpleCache import image_cache
 from Service.AsyncProcessor import async_processor
 import hashlib
+import io
+
+# Pillow 為選用套件，未安裝時直接上傳原圖
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
 
 # 設置日誌記錄
 logger = logging.getLogger(__name__)
 
+# 可重試的 Gemini 暫時性錯誤（429 配額限制與 5xx）
+_RETRYABLE_ERRORS = (
+    google_exceptions.ResourceExhausted,
+    google_exceptions.InternalServerError,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.DeadlineExceeded,
+)
+
+# 上傳給 Gemini 前將圖片縮小到的最長邊（像素）與重新壓縮的 JPEG 品質
+MAX_IMAGE_EDGE = 1024
+JPEG_QUALITY = 85
+
+# 圖片分析結果的 JSON schema（與 imagePrompt 描述的格式一致），交由 Gemini 原生 JSON 模式強制輸出
+IMAGE_ANALYSIS_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "intent": {"type": "STRING", "description": "早餐,中餐,晚餐,飲料,點心 或 無法辨識"},
+        "item": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "desc": {"type": "STRING", "description": "食物說明"},
+                    "cal": {"type": "STRING", "description": "{卡路里整數}大卡"}
+                },
+                "required": ["desc", "cal"]
+            }
+        },
+        "本餐共攝取": {"type": "STRING", "description": "{所有卡路里整數總和}大卡"}
+    },
+    "required": ["intent", "item"]
+}
+
 class ImageProcessService:
     def __init__(self):
         # 從配置檔讀取API金鑰、模型名稱和圖片處理的提示
@@ -27,44 +69,86 @@ class ImageProcessService:
         
         # 初始化 Gemini
         genai.configure(api_key=self.api_key)
+        
+        # 預先建立模型實例，所有請求共用（底層連線也一併重複使用）
+        # 使用原生 JSON 模式，回應必定是符合 schema 的 JSON，不會夾帶 markdown 區塊
+        self._model = genai.GenerativeModel(
+            self.model_name,
+            generation_config={
+                "response_mime_type": "application/json",
+                "response_schema": IMAGE_ANALYSIS_SCHEMA
+            }
+        )
+        self.max_retries = 2          # 暫時性錯誤的最多重試次數
+        self.retry_base_delay = 0.5   # 重試等待的起始秒數，每次加倍
+    
+    async def _generate_with_retry(self, parts):
+        """
+        呼叫 Gemini 產生內容，遇到 429/5xx 等暫時性錯誤時以指數退避重試
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with async_processor.gemini_semaphore:
+                    return await self._model.generate_content_async(parts)
+            except _RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = self.retry_base_delay * (2 ** attempt)
+                logger.warning(f"Gemini 暫時性錯誤，{delay:.1f} 秒後重試 ({attempt + 1}/{self.max_retries}): {str(e)}")
+                await asyncio.sleep(delay)
     
     @OptimizedErrorHandler(logger_name=__name__).fast_error_handler("處理圖片時發生錯誤")
-    def imageParse(self, image_path):
+    def imageParse(self, image_path, image_data=None):
         """
-        處理圖片，進行圖像分析並回傳處理結果
-        加入快取機制提升性能
+        處理圖片的同步介面
+        在共用的背景事件迴圈上執行 aimageParse，供控制器使用
+        """
+        return async_processor.run_coroutine(self.aimageParse(image_path, image_data))
+
+    def _reanalyze_image(self, image_path, cache_key):
+        """
+        快取背景刷新用：從磁碟重新讀取圖片並分析
+        圖片已不存在或內容已變更時拋出例外，由快取淘汰該鍵值
+        """
+        image_data = Path(image_path).read_bytes()
+        if f"image_{hashlib.blake2b(image_data, digest_size=16).hexdigest()}" != cache_key:
+            raise ValueError(f"圖片內容已變更: {image_path}")
+        return async_processor.run_coroutine(self._analyze_image_data(image_data))
+
+    @staticmethod
+    def _downscale_image(image_data):
+        """
+        將過大的圖片縮小至最長邊 MAX_IMAGE_EDGE 並重新壓縮為 JPEG，減少上傳量與圖片 token
+        未安裝 Pillow、圖片已夠小或無法解碼時返回原圖
+        """
+        if Image is None:
+            return image_data
+        
+        try:
+            with Image.open(io.BytesIO(image_data)) as img:
+                if max(img.size) <= MAX_IMAGE_EDGE:
+                    return image_data
+                
+                img.thumbnail((MAX_IMAGE_EDGE, MAX_IMAGE_EDGE))
+                buffer = io.BytesIO()
+                img.convert("RGB").save(buffer, "JPEG", quality=JPEG_QUALITY, optimize=True)
+                return buffer.getvalue()
+        except Exception as e:
+            logger.warning(f"縮小圖片失敗，改用原圖: {str(e)}")
+            return image_data
+    
+    async def _analyze_image_data(self, image_data):
+        """
+        將圖片內容送到 Gemini 分析，並解析為 JSON 物件
         
         Args:
-            image_path (str): 圖片的完整路徑
+            image_data (bytes): 圖片內容
             
         Returns:
-            dict: 包含處理結果的JSON物件
+            dict: 分析結果，無法解析為 JSON 時以 result 欄位包裝原始文字
         """
-        logger.info(f"開始處理圖片: {image_path}")
-        
-        # 確認圖片存在
-        image_file = Path(image_path)
-        if not image_file.exists():
-            error_msg = f"圖片不存在: {image_path}"
-            logger.error(error_msg)
-            return {"result": error_msg}
-        
-        # 生成圖片快取鍵 (基於文件大小和修改時間)
-        file_stat = image_file.stat()
-        cache_key = hashlib.md5(f"{image_path}_{file_stat.st_size}_{file_stat.st_mtime}".encode()).hexdigest()
-        
-        # 檢查快取
-        cached_result = image_cache.get(cache_key)
-        if cached_result:
-            logger.info(f"從快取獲取圖片分析結果: {image_path}")
-            return cached_result
-        
-        # 讀取圖片
-        with open(image_path, "rb") as f:
-            image_data = f.read()
-        
-        # 使用 Gemini 模型處理圖片
-        model = genai.GenerativeModel(self.model_name)
+        # 縮小過大的圖片（CPU 工作在工作線程執行）
+        image_data = await asyncio.to_thread(self._downscale_image, image_data)
         
         # 創建帶有系統提示的請求
         image_parts = [
@@ -72,8 +156,8 @@ class ImageProcessService:
             {"inline_data": {"mime_type": "image/jpeg", "data": base64.b64encode(image_data).decode('utf-8')}}
         ]
         
-        # 發送請求到 Gemini
-        response = model.generate_content(image_parts)
+        # 發送請求到 Gemini（共用模型實例，暫時性錯誤自動重試）
+        response = await self._generate_with_retry(image_parts)
         response_text = response.text
         
         # 檢查回應是否為 JSON 格式或包含 JSON 的文字
@@ -86,8 +170,48 @@ class ImageProcessService:
             logger.warning("無法解析 JSON，回傳原始文字")
             json_response = {"result": response_text}
         
-        # 將結果存入快取
-        image_cache.set(cache_key, json_response)
+        return json_response
+
+    async def aimageParse(self, image_path, image_data=None):
+        """
+        處理圖片，進行圖像分析並回傳處理結果
+        加入快取機制提升性能
+        
+        Args:
+            image_path (str): 圖片的完整路徑
+            image_data (bytes): 已在記憶體中的圖片內容（可選），提供時不再從磁碟讀取
+            
+        Returns:
+            dict: 包含處理結果的JSON物件
+        """
+        logger.info(f"開始處理圖片: {image_path}")
+        
+        # 讀取圖片（呼叫端已提供圖片內容時直接使用，否則在工作線程讀取，不阻塞事件迴圈）
+        if image_data is None:
+            image_file = Path(image_path)
+            if not image_file.exists():
+                error_msg = f"圖片不存在: {image_path}"
+                logger.error(error_msg)
+                return {"result": error_msg}
+            image_data = await asyncio.to_thread(image_file.read_bytes)
+        
+        # 生成圖片快取鍵（基於圖片內容，同一張照片以不同檔名重傳也能命中）
+        cache_key = f"image_{hashlib.blake2b(image_data, digest_size=16).hexdigest()}"
+        
+        # 檢查快取
+        cached_result = image_cache.get(cache_key)
+        if cached_result:
+            logger.info(f"從快取獲取圖片分析結果: {image_path}")
+            return cached_result
+        
+        json_response = await self._analyze_image_data(image_data)
+        
+        # 將結果存入快取，熱門圖片過期時在背景從磁碟重新讀圖分析（只保存路徑，不保存圖片內容）
+        image_cache.set(
+            cache_key,
+            json_response,
+            refresh_func=lambda: self._reanalyze_image(image_path, cache_key)
+        )
         
         logger.info(f"圖片處理完成")
         return json_response
@@ -1,6 +1,7 @@
 """
 優化的錯誤處理器，用於提高響應速度和統一錯誤處理流程
 """
+import inspect
 import logging
 from typing import Dict, Any, Optional, Union
 from functools import wraps
@@ -11,12 +12,22 @@ class OptimizedErrorHandler:
         self.logger = logging.getLogger(logger_name)
         self.error_count = 0
         self.last_error_time = None
+        self._seen_exceptions = {}  # (例外類型, 訊息前綴) -> 上次記錄時間
         
     def fast_error_handler(self, default_response: str = "系統暫時無法處理您的請求，請稍後再試"):
         """
         快速錯誤處理裝飾器 - 減少錯誤處理時間
         """
         def decorator(func):
+            if inspect.iscoroutinefunction(func):
+                @wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    try:
+                        return await func(*args, **kwargs)
+                    except Exception as e:
+                        return self._handle_error(e, func.__name__, default_response)
+                return async_wrapper
+            
             @wraps(func)
             def wrapper(*args, **kwargs):
                 try:
@@ -68,6 +79,29 @@ class OptimizedErrorHandler:
             "timestamp": time.time()
         }
     
+    def log_exception(self, message: str, exception: Exception, dedupe_seconds: int = 60, max_entries: int = 512) -> None:
+        """
+        記錄例外及堆疊，相同例外在 dedupe_seconds 內只記錄一次
+        堆疊由 logger.exception 在實際輸出時才格式化
+        """
+        key = (type(exception).__name__, str(exception)[:80])
+        now = time.time()
+        last_logged = self._seen_exceptions.get(key)
+        if last_logged is not None and now - last_logged < dedupe_seconds:
+            return
+        
+        if len(self._seen_exceptions) >= max_entries:
+            # 清除過期的紀錄，仍然過多時全部清空
+            self._seen_exceptions = {
+                seen_key: seen_time for seen_key, seen_time in self._seen_exceptions.items()
+                if now - seen_time < dedupe_seconds
+            }
+            if len(self._seen_exceptions) >= max_entries:
+                self._seen_exceptions.clear()
+        self._seen_exceptions[key] = now
+        
+        self.logger.exception("%s", message)
+    
     def validate_input_fast(self, data: Dict[str, Any], required_fields: list) -> Optional[str]:
         """
         快速輸入驗證 - 減少驗證時間
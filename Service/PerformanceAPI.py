@@ -6,6 +6,7 @@ from Service.ConnectionFactory import ConnectionFactory
 from Service.SimpleCache import app_cache, nlp_cache, image_cache, user_cache
 from Service.UnifiedResponseService import unified_response_service
 import time
+import inspect
 import logging
 from typing import Dict, Any
 from functools import wraps
@@ -24,6 +25,22 @@ class PerformanceMonitor:
         用於測量方法執行時間的裝飾器
         """
         def decorator(func):
+            if inspect.iscoroutinefunction(func):
+                @wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    start_time = time.time()
+                    self.total_requests += 1
+                    
+                    try:
+                        result = await func(*args, **kwargs)
+                        self._record_success(operation_name, start_time)
+                        return result
+                    except Exception as e:
+                        self._record_error(operation_name, start_time, e)
+                        raise
+                        
+                return async_wrapper
+            
             @wraps(func)
             def wrapper(*args, **kwargs):
                 start_time = time.time()
@@ -31,29 +48,32 @@ class PerformanceMonitor:
                 
                 try:
                     result = func(*args, **kwargs)
-                    end_time = time.time()
-                    response_time = end_time - start_time
-                    
-                    self.response_times.append(response_time)
-                    
-                    # 只在響應時間過長時記錄警告
-                    if response_time > 3.0:  # 超過3秒
-                        self.logger.warning(f"{operation_name} 響應時間過長: {response_time:.2f}秒")
-                    
+                    self._record_success(operation_name, start_time)
                     return result
-                    
                 except Exception as e:
-                    self.error_count += 1
-                    end_time = time.time()
-                    response_time = end_time - start_time
-                    self.response_times.append(response_time)
-                    
-                    self.logger.error(f"{operation_name} 發生錯誤 (耗時: {response_time:.2f}秒): {str(e)}")
+                    self._record_error(operation_name, start_time, e)
                     raise
                     
             return wrapper
         return decorator
     
+    def _record_success(self, operation_name: str, start_time: float):
+        """記錄成功執行的響應時間"""
+        response_time = time.time() - start_time
+        self.response_times.append(response_time)
+        
+        # 只在響應時間過長時記錄警告
+        if response_time > 3.0:  # 超過3秒
+            self.logger.warning(f"{operation_name} 響應時間過長: {response_time:.2f}秒")
+    
+    def _record_error(self, operation_name: str, start_time: float, exception: Exception):
+        """記錄發生錯誤時的響應時間"""
+        self.error_count += 1
+        response_time = time.time() - start_time
+        self.response_times.append(response_time)
+        
+        self.logger.error(f"{operation_name} 發生錯誤 (耗時: {response_time:.2f}秒): {str(exception)}")
+    
     def get_performance_stats(self) -> Dict[str, Any]:
         """
         獲取性能統計資訊
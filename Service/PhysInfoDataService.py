@@ -122,8 +122,8 @@ class PhysInfoDataService:
             # 清除現有快取
             cache_key_master = f"phys_info_{user_id}"
             cache_key_user = f"phys_info_user_{user_id}"
-            user_cache.cache.pop(cache_key_master, None)
-            user_cache.cache.pop(cache_key_user, None)
+            user_cache.delete(cache_key_master)
+            user_cache.delete(cache_key_user)
             
             # 重新載入資料到快取
             user_data = self._load_user_data_for_cache(user_id)
@@ -245,8 +245,8 @@ class PhysInfoDataService:
         if result:
             cache_key_master = f"phys_info_{master_id}"
             cache_key_user = f"phys_info_user_{master_id}"
-            user_cache.cache.pop(cache_key_master, None)
-            user_cache.cache.pop(cache_key_user, None)
+            user_cache.delete(cache_key_master)
+            user_cache.delete(cache_key_user)
             logger.info(f"已清除用戶 {master_id} 的快取")
         
         return {
@@ -384,8 +384,8 @@ class PhysInfoDataService:
         if result:
             cache_key_master = f"phys_info_{master_id}"
             cache_key_user = f"phys_info_user_{master_id}"
-            user_cache.cache.pop(cache_key_master, None)
-            user_cache.cache.pop(cache_key_user, None)
+            user_cache.delete(cache_key_master)
+            user_cache.delete(cache_key_user)
             logger.info(f"已清除用戶 {master_id} 的快取")
         
         return {
@@ -421,8 +421,8 @@ class PhysInfoDataService:
         if result:
             cache_key_master = f"phys_info_{master_id}"
             cache_key_user = f"phys_info_user_{master_id}"
-            user_cache.cache.pop(cache_key_master, None)
-            user_cache.cache.pop(cache_key_user, None)
+            user_cache.delete(cache_key_master)
+            user_cache.delete(cache_key_user)
             logger.info(f"已清除用戶 {master_id} 的快取")
         
         return {
@@ -1,6 +1,7 @@
 """
 預熱服務 - 提前初始化連接和載入模型以減少首次響應時間
 """
+import asyncio
 import logging
 import threading
 import time
@@ -42,14 +43,20 @@ class PrewarmService:
         try:
             from Service.ConnectionFactory import ConnectionPool
             
-            # 確保連接池已初始化
+            # 確保連接池已初始化（會預先建立 min_connections 個連接）
             pool = ConnectionPool()
             
-            # 測試連接
-            with pool.get_connection() as conn:
+            # 測試連接，用完歸還給連接池而不是關閉
+            conn = pool.get_connection()
+            if conn is None:
+                raise RuntimeError("無法從連接池取得連接")
+            try:
                 cursor = conn.cursor()
                 cursor.execute("SELECT 1")
                 cursor.fetchone()
+                cursor.close()
+            finally:
+                pool.return_connection(conn)
             
             logger.info("資料庫連接預熱完成")
             return True
@@ -58,6 +65,37 @@ class PrewarmService:
             logger.warning(f"資料庫連接預熱失敗: {str(e)}")
             return False
     
+    def prewarm_line_connection(self):
+        """預熱 LINE API 連接，讓共用 HTTP Session 先完成 TLS 握手"""
+        try:
+            from Service.HttpClient import http_session
+            from config.line_config import lineToken, getBotInfoUrl
+            
+            response = http_session.get(
+                getBotInfoUrl,
+                headers={'Authorization': f'Bearer {lineToken}'},
+                timeout=5
+            )
+            logger.info(f"LINE API 連接預熱完成: {response.status_code}")
+            return True
+            
+        except Exception as e:
+            logger.warning(f"LINE API 預熱失敗: {str(e)}")
+            return False
+    
+    def prewarm_async_processor(self):
+        """啟動共用的背景事件迴圈，避免第一個請求才建立"""
+        try:
+            from Service.AsyncProcessor import async_processor
+            
+            async_processor.run_coroutine(asyncio.sleep(0), timeout=5)
+            logger.info("背景事件迴圈預熱完成")
+            return True
+            
+        except Exception as e:
+            logger.warning(f"背景事件迴圈預熱失敗: {str(e)}")
+            return False
+    
     def prewarm_services(self):
         """預熱所有服務"""
         if self.is_prewarmed:
@@ -79,6 +117,12 @@ class PrewarmService:
         db_thread.start()
         tasks.append(db_thread)
         
+        # LINE API 與背景事件迴圈預熱
+        for target in (self.prewarm_line_connection, self.prewarm_async_processor):
+            thread = threading.Thread(target=target)
+            thread.start()
+            tasks.append(thread)
+        
         # 等待所有預熱完成
         for task in tasks:
             task.join(timeout=10)  # 10秒超時
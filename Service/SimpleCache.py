@@ -6,13 +6,16 @@ import time
 import json
 import hashlib
 import threading
-from typing import Dict, Any, Optional, Set
+from typing import Dict, Any, Optional, Set, Callable
 from functools import wraps
 from collections import defaultdict
 import logging
 
 logger = logging.getLogger(__name__)
 
+# 熱門鍵值過期後仍可返回舊資料的最長時間（以 TTL 的倍數計算），超過即淘汰
+STALE_TTL_MULTIPLIER = 2
+
 class SimpleCache:
     def __init__(self, default_ttl=300):  # 5分鐘過期
         self.cache = {}
@@ -21,6 +24,9 @@ class SimpleCache:
         self.last_access = {}  # 追蹤最後存取時間
         self.popular_keys = set()  # 熱門鍵值
         self.preload_lock = threading.Lock()
+        self.refresh_funcs = {}  # 鍵值 -> 重新產生資料的函數（有設定才會背景刷新）
+        self.refreshing = set()  # 正在背景刷新的鍵值，避免同一鍵值重複刷新
+        self.refresh_lock = threading.Lock()
         
     def _generate_key(self, *args, **kwargs) -> str:
         """生成快取鍵值"""
@@ -55,28 +61,78 @@ class SimpleCache:
                     key in self.popular_keys):
                     self._schedule_refresh(key)
                 
+                return data
+            elif (key in self.popular_keys and key in self.refresh_funcs and
+                  current_time - timestamp <= self.default_ttl * STALE_TTL_MULTIPLIER):
+                # 熱門鍵值過期時先返回舊資料，同時在背景重新載入（stale-while-revalidate）
+                logger.info(f"熱門快取過期，返回舊資料並背景重新載入: {key[:20]}...")
+                self._schedule_refresh(key)
                 return data
             else:
                 del self.cache[key]
-                # 如果是熱門鍵值，嘗試背景重新載入
-                if key in self.popular_keys:
-                    logger.info(f"熱門快取過期，嘗試背景重新載入: {key[:20]}...")
+                self.refresh_funcs.pop(key, None)
                     
         return None
     
-    def set(self, key: str, value: Any):
-        """設置快取值"""
+    def set(self, key: str, value: Any, refresh_func: Optional[Callable[[], Any]] = None):
+        """
+        設置快取值
+        
+        Args:
+            key: 快取鍵值
+            value: 快取值
+            refresh_func: 重新產生此鍵值資料的函數（可選），熱門鍵值即將過期或已過期時於背景呼叫
+        """
         self.cache[key] = (value, time.time())
+        if refresh_func is not None:
+            self.refresh_funcs[key] = refresh_func
         
         # 清理過期快取（簡單的LRU）
         if len(self.cache) > 100:
             self._cleanup_expired()
     
+    def delete(self, key: str):
+        """刪除快取值，並清除該鍵值的存取統計、熱門標記與刷新函數"""
+        with self.refresh_lock:
+            self.cache.pop(key, None)
+            self.refresh_funcs.pop(key, None)
+        self.access_count.pop(key, None)
+        self.last_access.pop(key, None)
+        self.popular_keys.discard(key)
+    
     def _schedule_refresh(self, key: str):
-        """安排背景刷新（預留接口）"""
-        # 這裡可以實現背景刷新邏輯
-        # 目前只記錄日誌
+        """安排背景刷新，同一鍵值同時只會有一個刷新線程"""
+        with self.refresh_lock:
+            refresh_func = self.refresh_funcs.get(key)
+            entry = self.cache.get(key)
+            if refresh_func is None or entry is None or key in self.refreshing:
+                return
+            self.refreshing.add(key)
+        
+        def _refresh():
+            try:
+                value = refresh_func()
+                with self.refresh_lock:
+                    # 刷新期間鍵值已被 delete 或重新 set 時捨棄結果，避免已失效的資料被寫回
+                    if self.cache.get(key) is not entry:
+                        logger.debug(f"快取已變更，捨棄背景刷新結果: {key[:20]}...")
+                        return
+                    self.cache[key] = (value, time.time())
+                logger.debug(f"背景刷新快取完成: {key[:20]}...")
+            except Exception as e:
+                logger.warning(f"背景刷新快取失敗 {key[:20]}...: {str(e)}")
+                # 刷新失敗時不再以已過期的舊資料回應，淘汰後由下次請求重新產生
+                with self.refresh_lock:
+                    current = self.cache.get(key)
+                    if current is entry and self._is_expired(entry[1]):
+                        self.cache.pop(key, None)
+                        self.refresh_funcs.pop(key, None)
+            finally:
+                with self.refresh_lock:
+                    self.refreshing.discard(key)
+        
         logger.debug(f"安排背景刷新快取: {key[:20]}...")
+        threading.Thread(target=_refresh, daemon=True).start()
     
     def preload_common_data(self, preload_func: callable, keys: list):
         """預載常用資料"""
@@ -116,6 +172,7 @@ class SimpleCache:
         ]
         for key in expired_keys:
             del self.cache[key]
+            self.refresh_funcs.pop(key, None)
     
     def cache_decorator(self, ttl: Optional[int] = None):
         """快取裝飾器"""
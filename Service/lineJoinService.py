@@ -1,7 +1,8 @@
 from typing import Dict, Any, Optional
-import requests
 import json
-from config.line_config import lineToken, getUserProfileUrl, getGroupProfileUrl, sendReplyMessageUrl
+from Service.HttpClient import http_session, DEFAULT_TIMEOUT
+from Service.AsyncProcessor import async_processor
+from config.line_config import lineToken, user_profile_url, group_profile_url, sendReplyMessageUrl
 import logging
 
 class LineJoinService:
@@ -16,8 +17,8 @@ class LineJoinService:
         """處理用戶追蹤事件"""
         try:
             user_id = event['source']['userId']
-            user_profile = self.get_user_profile(user_id)
-            self.logger.info(f"New follower: {user_profile.get('displayName', 'Unknown')}")
+            # 取得用戶資料與回覆歡迎訊息互不相依，在工作線程取得用戶資料的同時送出回覆
+            profile_future = async_processor.executor.submit(self.get_user_profile, user_id)
             
             # 在處理 follow 事件時回覆使用者
             reply_token = event.get('replyToken')
@@ -27,6 +28,9 @@ class LineJoinService:
                     'text': "你好~~我是熱量糾察隊～糾察你的熱量攝取,你可以提供你的食物照片,讓我幫你判斷你攝取了多少熱量,也可以查詢過往紀錄以及簡單的規劃為未來幾天的熱量攝取,現在請先提供你的性別,年齡(歲),身高(cm),體重(kg)一定要有單位,以及對什麼食物過敏"
                 }])
             
+            user_profile = profile_future.result(timeout=DEFAULT_TIMEOUT)
+            self.logger.info(f"New follower: {(user_profile or {}).get('displayName', 'Unknown')}")
+            
             # 在這裡可以加入資料庫處理邏輯
             return user_profile
         except Exception as e:
@@ -74,8 +78,8 @@ class LineJoinService:
     def get_user_profile(self, user_id: str) -> Optional[Dict[str, Any]]:
         """獲取用戶資料"""
         try:
-            url = getUserProfileUrl.format(userId=user_id)
-            response = requests.get(url, headers=self.headers)
+            url = user_profile_url(user_id)
+            response = http_session.get(url, headers=self.headers, timeout=DEFAULT_TIMEOUT)
             response.raise_for_status()
             return response.json()
         except Exception as e:
@@ -85,8 +89,8 @@ class LineJoinService:
     def get_group_summary(self, group_id: str) -> Optional[Dict[str, Any]]:
         """獲取群組資訊"""
         try:
-            url = getGroupProfileUrl.format(groupId=group_id)
-            response = requests.get(url, headers=self.headers)
+            url = group_profile_url(group_id)
+            response = http_session.get(url, headers=self.headers, timeout=DEFAULT_TIMEOUT)
             response.raise_for_status()
             return response.json()
         except Exception as e:
@@ -112,10 +116,11 @@ class LineJoinService:
             
             self.logger.info(f"發送回覆訊息: 目標token={reply_token[:10]}..., 訊息數量={len(messages)}")
             
-            response = requests.post(
+            response = http_session.post(
                 sendReplyMessageUrl,
                 headers=self.headers,
-                data=json.dumps(data)
+                data=json.dumps(data),
+                timeout=DEFAULT_TIMEOUT
             )
             
             if response.status_code == 200:
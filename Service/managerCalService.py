@@ -1,9 +1,9 @@
 import logging
 import json
-import traceback
 from typing import Dict, Any, Optional
 from Service.PhysInfoDataService import PhysInfoDataService
 from Service.ConnectionFactory import ConnectionFactory
+from Service.OptimizedErrorHandler import OptimizedErrorHandler
 
 # 設置日誌記錄
 logger = logging.getLogger(__name__)
@@ -15,6 +15,8 @@ class ManagerCalService:
         """
         logger.info("初始化卡路里管理服務")
         self.phys_info_service = PhysInfoDataService()
+        # 初始化優化的錯誤處理器
+        self.error_handler = OptimizedErrorHandler(__name__)
         
     def calculate_cal_function_definition(self) -> Dict[str, Any]:
         """
@@ -117,8 +119,7 @@ class ManagerCalService:
             
         except Exception as e:
             error_msg = f"處理卡路里數據時發生錯誤: {str(e)}"
-            logger.error(error_msg)
-            logger.error(traceback.format_exc())
+            self.error_handler.log_exception(error_msg, e)
             return {"result": f"處理您的卡路里數據時發生錯誤: {str(e)}"}
 
     def execute_cal_function(self, function_args: Dict[str, Any]) -> Dict[str, Any]:
@@ -181,6 +182,5 @@ class ManagerCalService:
             
         except Exception as e:
             error_msg = f"處理用戶ID的卡路里數據時發生錯誤: {str(e)}"
-            logger.error(error_msg)
-            logger.error(traceback.format_exc())
+            self.error_handler.log_exception(error_msg, e)
             return {"result": f"處理您的卡路里數據時發生錯誤: {str(e)}"}
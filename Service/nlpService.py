@@ -1,12 +1,14 @@
+import asyncio
 import logging
 import json
 import google.generativeai as genai
 from config import get_config
 from config.Prompt import chatPrompt, chatSearchPrompt, imageProcessReplyprompt
-import traceback
 import re
 import datetime
-from typing import Dict, Any, Optional, List
+import hashlib
+from dataclasses import dataclass, asdict
+from typing import Callable, Dict, Any, Optional, List, Tuple
 from Service.managerCalService import ManagerCalService
 from Service.FoodDataService import FoodDataService
 from Service.PhysInfoDataService import PhysInfoDataService
@@ -15,227 +17,423 @@ from Service.PerformanceAPI import performance_monitor
 from Service.SimpleCache import nlp_cache, user_cache
 from Service.AsyncProcessor import async_processor
 from Service.ConnectionFactory import ConnectionFactory
+from Service.ConversationStore import create_conversation_store
 
 # 設置日誌記錄
 logger = logging.getLogger(__name__)
 
-class NLPService:
-    def __init__(self):
-        # 從配置檔讀取API金鑰和模型名稱
-        config = get_config()
-        self.api_key = config['gemini']['apikey']
-        self.model_name = config['gemini']['model']
-        self.chat_prompt = chatPrompt
-        self.chat_search_prompt = chatSearchPrompt
-        self.image_process_reply_prompt = imageProcessReplyprompt
-        
-        # 初始化優化的錯誤處理器
-        self.error_handler = OptimizedErrorHandler(__name__)
-        
-        # 混合檢測架構配置
-        self.enable_unified_detection = True  # 是否啟用統一檢測
-        self.fallback_to_individual = True    # 是否允許回退到獨立檢測
-        self.unified_confidence_threshold = 0.7  # 統一檢測的信心度閾值
-        self.phys_info_function = {
-            "name": "extract_physical_info",
-            "description": "從用戶訊息中提取身體資訊",
-            "parameters": {
+# 飲食規劃提示詞模板（模組載入時建立一次，避免每次請求重新組字串）
+DIET_PROMPT_HEADER = """
+            基於以下用戶資訊，請為用戶規劃未來三天的健康飲食計劃，總文長400字：
+
+            ## 用戶基本資訊
+            - 用戶ID: {user_id}
+            - BMI: {bmi}
+            - 基礎代謝率(BMR): {bmr} 大卡
+            - 維持體重每日建議攝取量: {daily_calories} 大卡
+            - 減重時建議攝取量: {weight_loss_calories} 大卡
+            - 過敏食物: {allergic_foods}
+
+            ## 過去7天飲食記錄
+            """
+
+DIET_PROMPT_FOOTER = """
+            
+            ## 請提供以下內容：
+            1. **未來三天飲食規劃**：
+               - 每天的早餐、午餐、晚餐建議(50字)
+               - 每餐的大概卡路里分配(50字)
+               - 考慮用戶的卡路里需求和過敏食物(50字)
+               - 如果有過去飲食記錄，請分析飲食習慣並給出改善建議(50字)
+            
+            2. **營養建議**：
+               - 基於BMI和目標，提供具體的營養建議(100字以內)
+               - 如果用戶需要減重，請提供相應的飲食策略(100字以內)
+               
+            請以友善、實用的語氣回覆，讓用戶容易理解和執行。
+            """
+
+DIET_PROMPT_NO_RECORDS = "\n暫無過去飲食記錄（新用戶）\n"
+
+# 快速意圖預篩選的關鍵詞（依類別分組，單次掃描即可得到各類別命中數）
+_SCREENING_KEYWORDS = {
+    # 卡路里管理關鍵詞
+    "calorie": ("減重", "減肥", "瘦身", "卡路里", "熱量", "飲食計劃", "控制", "管理", "健康", "體重"),
+    "calorie_context": ("規劃", "計劃", "建議", "想要", "需要", "幫我", "想", "要"),
+    # 搜索關鍵詞
+    "search": ("查詢", "搜尋", "歷史", "記錄", "統計"),
+    "search_time": ("昨天", "前天", "上週", "上個月", "本週", "本月"),
+    "general_negative": ("天氣", "心情", "你好", "謝謝", "再見", "如何", "什麼", "為什麼"),
+    # 生理資訊關鍵詞 - 保持與 _detect_physical_info_by_keywords 一致
+    "physical": ("男", "女", "歲", "身高", "體重", "公分", "公斤", "cm", "kg", "CM", "KG", "過敏"),
+    # 圖片相關關鍵詞
+    "image": ("照片", "圖片", "拍攝", "識別", "分析", "圖像"),
+}
+
+# 只用於判斷是否出現的類別（不需要命中數）
+_PRESENCE_ONLY_CATEGORIES = frozenset({"calorie_context", "general_negative"})
+
+_NUMBER_RE = re.compile(r'\d+')
+
+# 身體資訊正則解析（Gemini 無法解析時的備援）
+_GENDER_RE = re.compile(r'([男女])性?')
+_AGE_RE = re.compile(r'(\d+)[歲岁]')
+_HEIGHT_RE = re.compile(r'(\d+(?:\.\d+)?)\s*(?:公分|cm)', re.IGNORECASE)
+_WEIGHT_RE = re.compile(r'(\d+(?:\.\d+)?)\s*(?:公斤|kg)', re.IGNORECASE)
+_ALLERGIC_RE = re.compile(r'(.+)[過过]敏')
+
+# 呼叫 Gemini 檢測意圖前的本地預篩選，訊息完全不含相關字詞時直接視為無意圖
+# （需涵蓋 _SCREENING_KEYWORDS 中對應類別的關鍵詞）
+_SEARCH_HINTS = re.compile(r'昨|今|前天|週|星期|月|卡路里|熱量|紀錄|記錄|吃|攝取|查詢|搜尋|歷史|統計|\d+[-/.]\d+')
+_CALORIE_HINTS = re.compile(r'減重|瘦身|減肥|卡路里|熱量|目標|計劃|規劃|控制|管理|健康|體重|飲食')
+
+# 完整生理資訊需涵蓋的四類關鍵詞（性別、年齡、身高、體重）與數字，合併成單一正則一次掃描取得命中的類別
+_PHYSICAL_SCAN_RE = re.compile(
+    r'(?P<gender>[男女]|性別)'
+    r'|(?P<age>[歲岁]|年[齡紀])'
+    r'|(?P<height>身高|公分|cm)'
+    r'|(?P<weight>體重|公斤|kg)'
+    r'|(?P<number>\d)',
+    re.IGNORECASE
+)
+_PHYSICAL_SCAN_CATEGORIES = frozenset(_PHYSICAL_SCAN_RE.groupindex)
+# 性別類關鍵詞一定包含的字元，訊息完全沒有這些字元時不可能是完整的生理資訊
+_PHYSICAL_GENDER_CHARS = frozenset("男女性")
+
+# 搜索意圖的 period_type -> 從今天往回推算的天數（本週、上週以週一為起始日）
+_PERIOD_DAYS_BACK = {
+    "today": lambda today: 0,
+    "yesterday": lambda today: 1,
+    "this_week": lambda today: today.weekday(),
+    "last_week": lambda today: today.weekday() + 7,
+}
+
+# 相對日期關鍵詞的開頭字元，訊息沒有這些字元也沒有數字時不可能包含日期
+_DATE_LEADING_CHARS = frozenset("今昨前上")
+
+# 訊息中的日期格式，合併成單一正則只掃描訊息一次，再依 _DATE_MATCH_PRIORITY 決定採用哪一個
+_DATE_SCAN_RE = re.compile(
+    r'(?P<full>(?P<year>\d{4})[-/.](?P<month>\d{1,2})[-/.](?P<day>\d{1,2}))'  # 2023-01-01、2023/01/01、2023.01.01
+    r'|(?P<partial>(?P<p_month>\d{1,2})[-/月](?P<p_day>\d{1,2})[日號]?)'        # 3月1日、3-1、3/1
+    r'|(?P<today>今[天日])'
+    r'|(?P<yesterday>昨[天日])'
+    r'|(?P<day_before>前天)'
+    r'|(?P<last_week>上(?:週|星期))'
+    r'|(?P<last_month>上個月)'
+    r'|(?P<days_ago>(?P<days>\d+)天前)'                                        # 3天前
+)
+_DATE_MATCH_PRIORITY = {
+    name: rank for rank, name in enumerate(
+        ("full", "partial", "today", "yesterday", "day_before", "last_week", "last_month", "days_ago")
+    )
+}
+# 相對日期 -> 往回推算的天數（上個月簡單處理為30天）
+_RELATIVE_DAYS_BACK = {"today": 0, "yesterday": 1, "day_before": 2, "last_week": 7, "last_month": 30}
+
+# 提取身體資訊的 function 定義
+PHYS_INFO_FUNCTION = {
+    "name": "extract_physical_info",
+    "description": "從用戶訊息中提取身體資訊",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "gender": {
+                "type": "string",
+                "description": "用戶的性別(男/女)"
+            },
+            "age": {
+                "type": "integer",
+                "description": "用戶的年齡(歲)"
+            },
+            "height": {
+                "type": "number",
+                "description": "用戶的身高(cm)"
+            },
+            "weight": {
+                "type": "number",
+                "description": "用戶的體重(kg)"
+            },
+            "allergic_foods": {
+                "type": "array",
+                "items": {
+                    "type": "string"
+                },
+                "description": "用戶過敏的食物清單"
+            }
+        },
+        "required": ["gender", "age", "height", "weight"]
+    }
+}
+
+# 搜索意圖的 function 定義
+SEARCH_INTENT_FUNCTION = {
+    "name": "extract_search_intent",
+    "description": "從用戶訊息中提取搜索意圖和時間範圍",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "has_search_intent": {
+                "type": "boolean",
+                "description": "用戶是否有搜索意圖"
+            },
+            "time_period": {
                 "type": "object",
                 "properties": {
-                    "gender": {
+                    "start_date": {
                         "type": "string",
-                        "description": "用戶的性別(男/女)"
-                    },
-                    "age": {
-                        "type": "integer",
-                        "description": "用戶的年齡(歲)"
+                        "description": "搜索起始日期 (YYYY-MM-DD格式)"
                     },
-                    "height": {
-                        "type": "number",
-                        "description": "用戶的身高(cm)"
-                    },
-                    "weight": {
-                        "type": "number",
-                        "description": "用戶的體重(kg)"
+                    "end_date": {
+                        "type": "string",
+                        "description": "搜索結束日期 (YYYY-MM-DD格式)"
                     },
-                    "allergic_foods": {
-                        "type": "array",
-                        "items": {
-                            "type": "string"
-                        },
-                        "description": "用戶過敏的食物清單"
+                    "period_type": {
+                        "type": "string",
+                        "enum": ["today", "yesterday", "this_week", "last_week", "this_month", "last_month", "specific_date", "date_range"],
+                        "description": "時間段類型"
                     }
                 },
-                "required": ["gender", "age", "height", "weight"]
+                "required": ["period_type"]
             }
-        }
-        
-        # 初始化搜索意圖的 function 定義
-        self.search_intent_function = {
-            "name": "extract_search_intent",
-            "description": "從用戶訊息中提取搜索意圖和時間範圍",
-            "parameters": {
+        },
+        "required": ["has_search_intent"]
+    }
+}
+
+# 卡路里管理意圖檢測的 function 定義
+CALORIE_INTENT_FUNCTION = {
+    "name": "detect_calorie_management_intent",
+    "description": "檢測用戶訊息是否包含卡路里管理或減重計劃的意圖",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "has_calorie_intent": {
+                "type": "boolean",
+                "description": "用戶是否有卡路里管理、減重計劃或健康飲食控制的意圖"
+            },
+            "intent_type": {
+                "type": "string",
+                "enum": ["weight_loss", "calorie_planning", "diet_control", "health_management", "none"],
+                "description": "卡路里管理意圖的具體類型"
+            },
+            "confidence": {
+                "type": "number",
+                "description": "檢測結果的信心度 (0.0 到 1.0 之間)"
+            },
+            "reason": {
+                "type": "string",
+                "description": "判斷的依據或原因"
+            }
+        },
+        "required": ["has_calorie_intent", "intent_type", "confidence"]
+    }
+}
+
+# 統一意圖檢測的 function 定義
+UNIFIED_INTENT_FUNCTION = {
+    "name": "detect_all_intents",
+    "description": "統一檢測用戶訊息中所有可能的意圖類型",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "primary_intent": {
+                "type": "string",
+                "enum": ["calorie_management", "search_history", "physical_info", "general_chat", "image_query"],
+                "description": "主要意圖類型"
+            },
+            "calorie_intent": {
                 "type": "object",
                 "properties": {
-                    "has_search_intent": {
-                        "type": "boolean",
-                        "description": "用戶是否有搜索意圖"
+                    "has_intent": {"type": "boolean"},
+                    "intent_type": {
+                        "type": "string", 
+                        "enum": ["weight_loss", "calorie_planning", "diet_control", "health_management", "none"]
                     },
+                    "confidence": {"type": "number"}
+                },
+                "required": ["has_intent", "confidence"]
+            },
+            "search_intent": {
+                "type": "object",
+                "properties": {
+                    "has_intent": {"type": "boolean"},
                     "time_period": {
                         "type": "object",
                         "properties": {
-                            "start_date": {
-                                "type": "string",
-                                "description": "搜索起始日期 (YYYY-MM-DD格式)"
-                            },
-                            "end_date": {
-                                "type": "string",
-                                "description": "搜索結束日期 (YYYY-MM-DD格式)"
-                            },
                             "period_type": {
                                 "type": "string",
-                                "enum": ["today", "yesterday", "this_week", "last_week", "this_month", "last_month", "specific_date", "date_range"],
-                                "description": "時間段類型"
+                                "enum": ["today", "yesterday", "this_week", "last_week", "this_month", "last_month", "specific_date", "date_range"]
                             }
-                        },
-                        "required": ["period_type"]
+                        }
                     }
                 },
-                "required": ["has_search_intent"]
-            }
-        }
-        
-        # 延遲初始化相關服務 - 避免重複創建
-        self._manager_cal_service = None
-        self._food_data_service = None
-        self._phys_info_service = None
-        
-        # 儲存每個用戶的對話歷史
-        self.conversation_history = {}
-        
-        # 初始化卡路里管理意圖檢測的 function 定義
-        self.calorie_intent_function = {
-            "name": "detect_calorie_management_intent",
-            "description": "檢測用戶訊息是否包含卡路里管理或減重計劃的意圖",
-            "parameters": {
+                "required": ["has_intent"]
+            },
+            "physical_info": {
                 "type": "object",
                 "properties": {
-                    "has_calorie_intent": {
-                        "type": "boolean",
-                        "description": "用戶是否有卡路里管理、減重計劃或健康飲食控制的意圖"
-                    },
-                    "intent_type": {
-                        "type": "string",
-                        "enum": ["weight_loss", "calorie_planning", "diet_control", "health_management", "none"],
-                        "description": "卡路里管理意圖的具體類型"
-                    },
-                    "confidence": {
-                        "type": "number",
-                        "description": "檢測結果的信心度 (0.0 到 1.0 之間)"
-                    },
-                    "reason": {
-                        "type": "string",
-                        "description": "判斷的依據或原因"
-                    }
-                },
-                "required": ["has_calorie_intent", "intent_type", "confidence"]
-            }
-        }
-        
-        # 統一意圖檢測的 function 定義
-        self.unified_intent_function = {
-            "name": "detect_all_intents",
-            "description": "統一檢測用戶訊息中所有可能的意圖類型",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "primary_intent": {
-                        "type": "string",
-                        "enum": ["calorie_management", "search_history", "physical_info", "general_chat", "image_query"],
-                        "description": "主要意圖類型"
-                    },
-                    "calorie_intent": {
-                        "type": "object",
-                        "properties": {
-                            "has_intent": {"type": "boolean"},
-                            "intent_type": {
-                                "type": "string", 
-                                "enum": ["weight_loss", "calorie_planning", "diet_control", "health_management", "none"]
-                            },
-                            "confidence": {"type": "number"}
-                        },
-                        "required": ["has_intent", "confidence"]
-                    },
-                    "search_intent": {
+                    "has_intent": {"type": "boolean"},
+                    "extracted_info": {
                         "type": "object",
                         "properties": {
-                            "has_intent": {"type": "boolean"},
-                            "time_period": {
-                                "type": "object",
-                                "properties": {
-                                    "period_type": {
-                                        "type": "string",
-                                        "enum": ["today", "yesterday", "this_week", "last_week", "this_month", "last_month", "specific_date", "date_range"]
-                                    }
-                                }
+                            "gender": {"type": "string"},
+                            "age": {"type": "integer"},
+                            "height": {"type": "number"},
+                            "weight": {"type": "number"},
+                            "allergic_foods": {
+                                "type": "array",
+                                "items": {"type": "string"}
                             }
-                        },
-                        "required": ["has_intent"]
-                    },
-                    "physical_info": {
-                        "type": "object",
-                        "properties": {
-                            "has_intent": {"type": "boolean"},
-                            "extracted_info": {
-                                "type": "object",
-                                "properties": {
-                                    "gender": {"type": "string"},
-                                    "age": {"type": "integer"},
-                                    "height": {"type": "number"},
-                                    "weight": {"type": "number"},
-                                    "allergic_foods": {
-                                        "type": "array",
-                                        "items": {"type": "string"}
-                                    }
-                                }
-                            }
-                        },
-                        "required": ["has_intent"]
-                    },
-                    "confidence": {
-                        "type": "number",
-                        "description": "整體檢測的信心度"
+                        }
                     }
                 },
-                "required": ["primary_intent", "confidence"]
+                "required": ["has_intent"]
+            },
+            "confidence": {
+                "type": "number",
+                "description": "整體檢測的信心度"
             }
-        }
+        },
+        "required": ["primary_intent", "confidence"]
+    }
+}
+
+# function calling 使用的 tools 設定（所有實例共用）
+PHYS_INFO_TOOLS = [{"function_declarations": [PHYS_INFO_FUNCTION]}]
+SEARCH_INTENT_TOOLS = [{"function_declarations": [SEARCH_INTENT_FUNCTION]}]
+CALORIE_INTENT_TOOLS = [{"function_declarations": [CALORIE_INTENT_FUNCTION]}]
+UNIFIED_INTENT_TOOLS = [{"function_declarations": [UNIFIED_INTENT_FUNCTION]}]
+
+@dataclass(slots=True)
+class DetectionConfig:
+    """混合檢測架構配置，可由 configure_detection_method 動態調整"""
+    enable_unified_detection: bool = True     # 是否啟用統一檢測
+    fallback_to_individual: bool = True       # 是否允許回退到獨立檢測
+    unified_confidence_threshold: float = 0.7  # 統一檢測的信心度閾值
+
+class NLPService:
+    def __init__(self):
+        # 從配置檔讀取API金鑰和模型名稱
+        config = get_config()
+        self.api_key = config['gemini']['apikey']
+        self.model_name = config['gemini']['model']
+        self.chat_prompt = chatPrompt
+        self.chat_search_prompt = chatSearchPrompt
+        self.image_process_reply_prompt = imageProcessReplyprompt
+        
+        # 初始化優化的錯誤處理器
+        self.error_handler = OptimizedErrorHandler(__name__)
+        
+        # 混合檢測架構配置
+        self._detection_config = DetectionConfig()
+        self._last_detection_method = 'unknown'
+        self.batch_concurrency = 8               # 批次意圖檢測同時送出的 Gemini 請求數上限
+        self.defer_image_suggestion = True       # 圖片分析先回覆結果，營養建議產生後再推播
+        
+        # 啟動時即初始化相關服務，避免首個請求承擔初始化延遲
+        self.manager_cal_service = ManagerCalService()
+        self.food_data_service = FoodDataService()
+        self.phys_info_service = PhysInfoDataService()
+        
+        # 對話歷史儲存：每則訊息為 {"role", "parts"}，設定 redis.url 時改存於 Redis 供多個 worker 共用
+        self.max_conversation_users = 2000      # 最多保留的用戶對話數（程序內儲存）
+        self.max_history_messages = 20          # 每個對話保留的最近訊息數
+        self.conversation_store = create_conversation_store(
+            config,
+            max_users=self.max_conversation_users,
+            max_messages=self.max_history_messages
+        )
+        self.history_token_budget = int(8192 * 0.8)  # 對話歷史的估算 token 上限
+        self._background_tasks = set()          # 背景任務（保留引用避免被回收）
+        self._history_queues = {}               # user_id -> 待寫入的搜索對話歷史佇列（每個用戶一個寫入任務）
+        self.history_queue_size = 32            # 每個用戶待寫入佇列的上限，滿了就捨棄
+        self.history_batch_size = 8             # 寫入任務每次合併寫入的最多筆數
+        self.history_writer_idle = 5.0          # 佇列閒置多久（秒）後結束寫入任務
         
         # 初始化 Gemini
         genai.configure(api_key=self.api_key)
         
-    @property
-    def manager_cal_service(self):
-        if self._manager_cal_service is None:
-            self._manager_cal_service = ManagerCalService()
-        return self._manager_cal_service
+        # 預先建立各用途的模型實例，tools 與生成設定只在此轉換一次，請求時直接重複使用
+        precise_config = {"temperature": 0.2}
+        # 意圖檢測的 schema 本身可表達「無意圖」，強制模型一定回傳 function call，避免產生無用的自由文字
+        force_function_call = {"function_calling_config": {"mode": "ANY"}}
+        self._unified_intent_model = genai.GenerativeModel(
+            self.model_name, generation_config=precise_config, tools=UNIFIED_INTENT_TOOLS,
+            tool_config=force_function_call
+        )
+        # 身體資訊擷取不強制 function call，資訊不完整時交由正則備援處理，避免模型補上不存在的數值
+        self._phys_info_model = genai.GenerativeModel(
+            self.model_name, generation_config=precise_config, tools=PHYS_INFO_TOOLS
+        )
+        self._calorie_intent_model = genai.GenerativeModel(
+            self.model_name, generation_config=precise_config, tools=CALORIE_INTENT_TOOLS,
+            tool_config=force_function_call
+        )
+        self._search_intent_model = genai.GenerativeModel(
+            self.model_name, generation_config=precise_config, tools=SEARCH_INTENT_TOOLS,
+            tool_config=force_function_call
+        )
+        self._diet_plan_model = genai.GenerativeModel(self.model_name, generation_config={"temperature": 0.7})
+        # 系統提示以 system_instruction 傳入，不佔用對話歷史
+        self._chat_model = genai.GenerativeModel(self.model_name, system_instruction=self.chat_prompt or None)
+        self._image_reply_model = genai.GenerativeModel(
+            self.model_name, system_instruction=self.image_process_reply_prompt or None
+        )
+        self._default_model = genai.GenerativeModel(self.model_name)
+        
+    @staticmethod
+    def _intent_cache_key(prefix: str, message_text: str) -> str:
+        """
+        產生意圖檢測結果的快取鍵值，訊息先正規化（去除首尾空白、轉小寫、合併連續空白）
+        讓只有大小寫或空白差異的重複訊息也能命中快取
+        """
+        normalized = " ".join(message_text.lower().split())
+        return f"{prefix}_{hashlib.md5(normalized.encode()).hexdigest()}"
     
-    @property 
-    def food_data_service(self):
-        if self._food_data_service is None:
-            self._food_data_service = FoodDataService()
-        return self._food_data_service
+    @staticmethod
+    def _extract_function_args(response, expected_name: str):
+        """
+        取出回應中第一個 part 的 function call 原始參數，不轉換成 dict
+        
+        Args:
+            response: Gemini generate_content 的回應
+            expected_name (str): 預期的 function 名稱
+            
+        Returns:
+            Mapping or None: function call 原始參數，名稱不符或沒有 function call 時返回 None
+        """
+        try:
+            function_call = response.candidates[0].content.parts[0].function_call
+        except (IndexError, AttributeError):
+            return None
+        if function_call and function_call.name == expected_name:
+            return function_call.args
+        return None
+    
+    @staticmethod
+    def _physical_info_from_args(args) -> Dict[str, Any]:
+        """
+        從 extract_physical_info 的原始參數只取出需要的欄位，過敏食物統一轉成普通 list
+        """
+        result = {key: args[key] for key in ("gender", "age", "height", "weight") if key in args}
+        allergic_foods = args.get("allergic_foods") or []
+        result["allergic_foods"] = [allergic_foods] if isinstance(allergic_foods, str) else list(allergic_foods)
+        return result
     
-    @property
-    def phys_info_service(self):
-        if self._phys_info_service is None:
-            # 引入並初始化 PhysInfoDataService
-            from Service.PhysInfoDataService import PhysInfoDataService
-            self._phys_info_service = PhysInfoDataService()
-        return self._phys_info_service
+    @staticmethod
+    def _pluck(args, *path, default=None):
+        """
+        沿著路徑取出巢狀參數中的單一欄位，任一層不存在時返回 default
+        """
+        current = args
+        for key in path:
+            current = current.get(key) if hasattr(current, 'get') else None
+            if current is None:
+                return default
+        return current
     
     @OptimizedErrorHandler(logger_name=__name__).fast_error_handler("統一意圖檢測失敗")
-    def unified_intent_detection(self, message_text: str) -> Dict[str, Any]:
+    async def unified_intent_detection(self, message_text: str) -> Dict[str, Any]:
         """
         統一的意圖檢測，一次 API 調用識別所有可能的意圖
         包含快取機制以提高響應速度
@@ -243,8 +441,7 @@ class NLPService:
         logger.info(f"開始統一意圖檢測: {message_text}")
         
         # 生成快取鍵值
-        import hashlib
-        cache_key = f"intent_{hashlib.md5(message_text.encode()).hexdigest()}"
+        cache_key = self._intent_cache_key("intent", message_text)
         
         # 檢查快取
         cached_result = nlp_cache.get(cache_key)
@@ -253,14 +450,6 @@ class NLPService:
             return cached_result
         
         # 使用 Gemini 進行統一意圖解析
-        model = genai.GenerativeModel(
-            model_name=self.model_name,
-            generation_config={"temperature": 0.2}
-        )
-        
-        # 設置 function calling
-        tools = [{"function_declarations": [self.unified_intent_function]}]
-        
         prompt = f"""
         分析以下用戶訊息，識別其中包含的所有意圖類型：
         
@@ -273,19 +462,34 @@ class NLPService:
         用戶訊息：{message_text}
         """
         
-        response = model.generate_content(prompt, tools=tools)
+        response = await self._generate(self._unified_intent_model, prompt)
         
-        # 提取 function calling 結果
-        function_response = None
-        for part in response.parts:
-            if hasattr(part, 'function_call'):
-                function_response = part.function_call
-                break
+        # 提取 function calling 結果，只取出後續流程會用到的欄位，避免轉換整個巢狀結構
+        args = self._extract_function_args(response, "detect_all_intents")
         
-        if function_response and function_response.name == "detect_all_intents":
-            result = dict(function_response.args)
-            result['success'] = True
-            result['method'] = 'unified'
+        if args is not None:
+            result = {
+                'primary_intent': self._pluck(args, 'primary_intent'),
+                'confidence': self._pluck(args, 'confidence', default=0.0),
+                'success': True,
+                'method': 'unified'
+            }
+            if 'calorie_intent' in args:
+                result['calorie_intent'] = {
+                    'has_intent': self._pluck(args, 'calorie_intent', 'has_intent', default=False),
+                    'intent_type': self._pluck(args, 'calorie_intent', 'intent_type', default='general'),
+                    'confidence': self._pluck(args, 'calorie_intent', 'confidence', default=0.0)
+                }
+            if 'search_intent' in args:
+                period_type = self._pluck(args, 'search_intent', 'time_period', 'period_type')
+                result['search_intent'] = {
+                    'has_intent': self._pluck(args, 'search_intent', 'has_intent', default=False),
+                    'time_period': {'period_type': period_type} if period_type else {}
+                }
+            if 'physical_info' in args:
+                result['physical_info'] = {
+                    'has_intent': self._pluck(args, 'physical_info', 'has_intent', default=False)
+                }
             
             # 將結果存入快取（快取 10 分鐘）
             nlp_cache.set(cache_key, result)
@@ -299,7 +503,7 @@ class NLPService:
             'method': 'unified'
         }
 
-    def quick_intent_screening(self, message_text: str) -> List[str]:
+    def quick_intent_screening(self, message_text: str) -> Tuple[List[str], Dict[str, int]]:
         """
         快速意圖預篩選，使用關鍵詞進行初步判斷
         
@@ -307,67 +511,93 @@ class NLPService:
             message_text (str): 用戶訊息文字
             
         Returns:
-            list: 可能的意圖類型列表
+            tuple: (可能的意圖類型列表, 各意圖命中的關鍵詞數量)
         """
         possible_intents = []
-        
-        # 卡路里管理關鍵詞
-        calorie_keywords = ["減重", "減肥", "瘦身", "卡路里", "熱量", "飲食計劃", "控制", "管理", "健康", "體重"]
-        calorie_context_keywords = ["規劃", "計劃", "建議", "想要", "需要", "幫我", "想", "要"]
-        
-        has_calorie = any(keyword in message_text for keyword in calorie_keywords)
-        has_calorie_context = any(keyword in message_text for keyword in calorie_context_keywords)
+        intent_counts = {}
+        
+        # 每個類別只掃描一次（合併原本重複的 any()/sum() 掃描），取得各類別的命中數
+        # 只需判斷有無的類別使用 any()，命中第一個關鍵詞即停止
+        counts = {
+            category: (any(keyword in message_text for keyword in keywords)
+                       if category in _PRESENCE_ONLY_CATEGORIES
+                       else sum(1 for keyword in keywords if keyword in message_text))
+            for category, keywords in _SCREENING_KEYWORDS.items()
+        }
         
         # 只有當有卡路里關鍵詞且有相關上下文時，才判定為卡路里管理意圖
-        if has_calorie and has_calorie_context:
+        if counts["calorie"] and counts["calorie_context"]:
             possible_intents.append("calorie_management")
-        
-        # 搜索關鍵詞
-        search_keywords = ["查詢", "搜尋", "歷史", "記錄", "統計"]
-        search_time_keywords = ["昨天", "前天", "上週", "上個月", "本週", "本月"]
-        general_chat_negative = ["天氣", "心情", "你好", "謝謝", "再見", "如何", "什麼", "為什麼"]
-        
-        has_search = any(keyword in message_text for keyword in search_keywords)
-        has_time = any(keyword in message_text for keyword in search_time_keywords)
-        has_general = any(keyword in message_text for keyword in general_chat_negative)
+            intent_counts["calorie_management"] = counts["calorie"]
         
         # 明確的搜索意圖：有搜索詞或時間詞，且不是一般對話
-        if (has_search or has_time) and not has_general:
+        search_count = counts["search"] + counts["search_time"]
+        if search_count and not counts["general_negative"]:
             possible_intents.append("search_history")
-        
-        # 生理資訊關鍵詞 - 保持與 _detect_physical_info_by_keywords 一致
-        physical_keywords = ["男", "女", "歲", "身高", "體重", "公分", "公斤", "cm", "kg", "CM", "KG", "過敏"]
-        number_pattern = r'\d+'
-        
-        has_physical = any(keyword in message_text for keyword in physical_keywords)
-        has_numbers = bool(re.search(number_pattern, message_text))
-        physical_count = sum(1 for keyword in physical_keywords if keyword in message_text)
+            intent_counts["search_history"] = search_count
         
         # 需要至少3個生理關鍵詞和數字才判定為生理資訊
-        if has_physical and has_numbers and physical_count >= 3:
+        physical_count = counts["physical"]
+        if physical_count >= 3 and _NUMBER_RE.search(message_text) is not None:
             possible_intents.append("physical_info")
+            intent_counts["physical_info"] = physical_count
         
-        # 圖片相關關鍵詞
-        image_keywords = ["照片", "圖片", "拍攝", "識別", "分析", "圖像"]
-        if any(keyword in message_text for keyword in image_keywords):
+        if counts["image"]:
             possible_intents.append("image_query")
+            intent_counts["image_query"] = counts["image"]
         
         # 如果沒有匹配任何關鍵詞，視為一般對話
         if not possible_intents:
             possible_intents.append("general_chat")
         
-        logger.info(f"快速篩選結果: {possible_intents}")
-        return possible_intents
+        logger.info(f"快速篩選結果: {possible_intents}, 關鍵詞命中數: {intent_counts}")
+        return possible_intents, intent_counts
+
+    def _keyword_confident_intent(self, intent_counts: Dict[str, int]) -> Optional[Dict[str, Any]]:
+        """
+        當關鍵詞明顯集中於單一意圖時，直接產生檢測結果，跳過 LLM 統一檢測
+        
+        Args:
+            intent_counts (dict): 各意圖命中的關鍵詞數量
+            
+        Returns:
+            dict or None: 高信心度的檢測結果，無法判定時返回 None
+        """
+        if not intent_counts:
+            return None
+        
+        ranked = sorted(intent_counts.items(), key=lambda item: item[1], reverse=True)
+        top_intent, top_count = ranked[0]
+        second_count = ranked[1][1] if len(ranked) > 1 else 0
+        
+        # 領先第二名至少2個關鍵詞，或單一意圖命中至少4個關鍵詞
+        if top_count - second_count < 2 and top_count < 4:
+            return None
+        
+        result = {
+            'primary_intent': top_intent,
+            'confidence': 0.9,
+            'method': 'keyword_confident',
+            'success': True,
+            'possible_intents': list(intent_counts)
+        }
+        if top_intent == 'calorie_management':
+            result['calorie_intent'] = {'has_intent': True, 'intent_type': 'calorie_planning', 'confidence': 0.9}
+        elif top_intent == 'search_history':
+            result['search_intent'] = {'has_intent': True, 'time_period': {}}
+        
+        logger.info(f"關鍵詞高信心度判定為 {top_intent}，跳過統一意圖檢測")
+        return result
 
     @OptimizedErrorHandler(logger_name=__name__).fast_error_handler("智能意圖檢測失敗")
-    def smart_intent_detection(self, message_text: str) -> Dict[str, Any]:
+    async def smart_intent_detection(self, message_text: str) -> Dict[str, Any]:
         """
         智能意圖檢測：結合快速篩選和精確檢測
         """
         logger.info(f"開始智能意圖檢測: {message_text}")
         
         # 第一層：快速關鍵詞預篩選
-        possible_intents = self.quick_intent_screening(message_text)
+        possible_intents, intent_counts = self.quick_intent_screening(message_text)
         
         # 第二層：根據篩選結果選擇檢測策略
         if len(possible_intents) == 1 and possible_intents[0] == "general_chat":
@@ -383,7 +613,7 @@ class NLPService:
             # 只有一個明確意圖，使用專門的檢測函數
             intent_type = possible_intents[0]
             if intent_type == "calorie_management":
-                result = self.check_calorie_management_intent(message_text)
+                result = await self.check_calorie_management_intent(message_text)
                 return {
                     'primary_intent': 'calorie_management',
                     'calorie_intent': result,
@@ -391,7 +621,7 @@ class NLPService:
                     'success': True
                 }
             elif intent_type == "search_history":
-                result = self.check_search_intent(message_text)
+                result = await self.check_search_intent(message_text)
                 return {
                     'primary_intent': 'search_history',
                     'search_intent': result,
@@ -399,22 +629,32 @@ class NLPService:
                     'success': True
                 }
             else:
+                # 關鍵詞已足夠明確時，不需再呼叫統一檢測
+                confident_result = self._keyword_confident_intent(intent_counts)
+                if confident_result:
+                    return confident_result
+                
                 # 對於其他單一意圖，也使用統一檢測
-                if self.enable_unified_detection:
-                    return self.unified_intent_detection(message_text)
+                if self._detection_config.enable_unified_detection:
+                    return await self.unified_intent_detection(message_text)
                 else:
-                    return self._fallback_to_individual_detection(message_text)
+                    return await self._fallback_to_individual_detection(message_text)
         
         else:
+            # 多個可能意圖時，若關鍵詞明顯集中於單一意圖則直接採用
+            confident_result = self._keyword_confident_intent(intent_counts)
+            if confident_result:
+                return confident_result
+            
             # 多個可能意圖或複雜情況，使用統一檢測
-            if self.enable_unified_detection:
-                unified_result = self.unified_intent_detection(message_text)
+            if self._detection_config.enable_unified_detection:
+                unified_result = await self.unified_intent_detection(message_text)
                 if unified_result.get('success', False):
                     return unified_result
             
             # 統一檢測失敗，回退到獨立檢測
-            if self.fallback_to_individual:
-                return self._fallback_to_individual_detection(message_text)
+            if self._detection_config.fallback_to_individual:
+                return await self._fallback_to_individual_detection(message_text)
             else:
                 return {
                     'primary_intent': 'general_chat',
@@ -423,7 +663,7 @@ class NLPService:
                     'error': 'All detection methods failed'
                 }
 
-    def _fallback_to_individual_detection(self, message_text: str) -> Dict[str, Any]:
+    async def _fallback_to_individual_detection(self, message_text: str) -> Dict[str, Any]:
         """
         回退到獨立檢測方法
         
@@ -438,7 +678,7 @@ class NLPService:
             
             # 依序檢測各種意圖
             # 1. 檢測卡路里管理意圖
-            calorie_result = self.check_calorie_management_intent(message_text)
+            calorie_result = await self.check_calorie_management_intent(message_text)
             if calorie_result.get("has_calorie_intent", False):
                 return {
                     'primary_intent': 'calorie_management',
@@ -448,7 +688,7 @@ class NLPService:
                 }
             
             # 2. 檢測搜索意圖
-            search_result = self.check_search_intent(message_text)
+            search_result = await self.check_search_intent(message_text)
             if search_result.get("has_search_intent", False):
                 return {
                     'primary_intent': 'search_history',
@@ -483,7 +723,34 @@ class NLPService:
                 'error': str(e)
             }
     
-    def generate_diet_planning_for_new_user(self, user_id: str) -> Dict[str, Any]:
+    async def _get_phys_info(self, user_id: str) -> Dict[str, Any]:
+        """
+        取得用戶身體資訊，查詢結果（包含查無資料）快取於 user_cache
+        快取命中時不需切換執行緒，直接在事件迴圈上返回
+        
+        Args:
+            user_id (str): 用戶ID
+            
+        Returns:
+            dict: 與 get_phys_info_by_user_id 相同格式的回應
+        """
+        cache_key = f"nlp_phys_info_{user_id}"
+        cached_response = user_cache.get(cache_key)
+        if cached_response is not None:
+            return cached_response
+        
+        phys_info_response = await ConnectionFactory.run_async(self.phys_info_service.get_phys_info_by_user_id, user_id)
+        
+        # 只快取成功與查無資料的結果，資料庫連線錯誤不快取
+        if phys_info_response["status"] == "success" or str(phys_info_response.get("result", "")).startswith("找不到"):
+            user_cache.set(cache_key, phys_info_response)
+        return phys_info_response
+
+    def _invalidate_phys_info(self, user_id: str):
+        """清除用戶身體資訊的快取"""
+        user_cache.delete(f"nlp_phys_info_{user_id}")
+
+    async def generate_diet_planning_for_new_user(self, user_id: str) -> Dict[str, Any]:
         """
         為新用戶生成卡路里計算結果和未來三天飲食規劃
         
@@ -496,12 +763,12 @@ class NLPService:
         try:
             logger.info(f"開始為新用戶 {user_id} 生成飲食規劃")
             
-            # 1. 獲取卡路里計算結果
-            cal_result = self.manager_cal_service.process_user_id(user_id)
-            
-            # 2. 獲取用戶的過敏食物資訊
-            # 使用新的方法直接通過user_id獲取身體資訊
-            phys_info_response = self.phys_info_service.get_phys_info_by_user_id(user_id)
+            # 1. 獲取卡路里計算結果（資料庫查詢移至執行緒，避免阻塞事件迴圈）
+            # 2. 同時獲取用戶的身體資訊（取得過敏食物），兩者互不相依
+            cal_result, phys_info_response = await asyncio.gather(
+                ConnectionFactory.run_async(self.manager_cal_service.process_user_id, user_id),
+                self._get_phys_info(user_id)
+            )
             allergic_foods = []
             if phys_info_response["status"] == "success":
                 allergic_foods = phys_info_response["result"].get('allergic_foods', [])
@@ -510,7 +777,7 @@ class NLPService:
             past_records = []
             
             # 4. 使用Gemini生成未來三天飲食規劃
-            planning_result = self._generate_diet_plan_with_gemini(
+            planning_result = await self._generate_diet_plan_with_gemini(
                 cal_result, past_records, allergic_foods, user_id
             )
             
@@ -526,95 +793,182 @@ class NLPService:
             
         except Exception as e:
             error_msg = f"生成新用戶飲食規劃時發生錯誤: {str(e)}"
-            logger.error(error_msg)
-            logger.error(traceback.format_exc())
+            self.error_handler.log_exception(error_msg, e)
             return {
                 "result": error_msg,
                 "status": "error"
             }
     
-    def _generate_diet_plan_with_gemini(self, cal_result: Dict[str, Any], past_records: List[Dict[str, Any]], 
+    async def _generate_diet_plan_with_gemini(self, cal_result: Dict[str, Any], past_records: List[Dict[str, Any]], 
                                       allergic_foods: List[str], user_id: str) -> str:
         """
         使用Gemini LLM生成未來三天的飲食規劃
-        包含快取機制以提高響應速度
+        合併串流輸出的片段，供需要完整文字的呼叫端使用
         """
         try:
-            # 生成快取鍵值（基於用戶基本資料和過敏食物）
-            cache_key = f"diet_plan_{user_id}_{cal_result.get('bmi', 0)}_{cal_result.get('bmr', 0)}_{sorted(allergic_foods)}"
-            
-            # 檢查快取
-            cached_result = nlp_cache.get(cache_key)
-            if cached_result:
-                logger.info(f"使用快取的飲食規劃結果: {user_id}")
-                return cached_result
-        
+            chunks = [
+                chunk async for chunk in self._generate_diet_plan_with_gemini_stream(
+                    cal_result, past_records, allergic_foods, user_id
+                )
+            ]
+            return "".join(chunks)
             
-            # 準備提示詞
-            prompt = f"""
-            基於以下用戶資訊，請為用戶規劃未來三天的健康飲食計劃，總文長400字：
+        except Exception as e:
+            logger.error(f"生成飲食規劃失敗: {str(e)}")
+            return f"抱歉，生成飲食規劃時發生錯誤: {str(e)}"
 
-            ## 用戶基本資訊
-            - 用戶ID: {user_id}
-            - BMI: {cal_result.get('bmi', '未知')}
-            - 基礎代謝率(BMR): {cal_result.get('bmr', '未知')} 大卡
-            - 維持體重每日建議攝取量: {cal_result.get('daily_calories', '未知')} 大卡
-            - 減重時建議攝取量: {cal_result.get('weight_loss_calories', '未知')} 大卡
-            - 過敏食物: {', '.join(allergic_foods) if allergic_foods else '無'}
+    async def _generate_diet_plan_with_gemini_stream(self, cal_result: Dict[str, Any], past_records: List[Dict[str, Any]],
+                                             allergic_foods: List[str], user_id: str):
+        """
+        以串流方式生成未來三天的飲食規劃，逐段產出文字以縮短首段回應時間
+        包含快取機制：命中時一次產出完整結果，生成完成後寫入快取
+        """
+        # 生成快取鍵值（基於用戶基本資料和過敏食物）
+        cache_key = f"diet_plan_{user_id}_{cal_result.get('bmi', 0)}_{cal_result.get('bmr', 0)}_{sorted(allergic_foods)}"
+        
+        # 檢查快取
+        cached_result = nlp_cache.get(cache_key)
+        if cached_result:
+            logger.info(f"使用快取的飲食規劃結果: {user_id}")
+            yield cached_result
+            return
+        
+        prompt = self._build_diet_prompt(cal_result, past_records, allergic_foods, user_id)
+        
+        # 串流生成回應（串流期間持續佔用一個 Gemini 並行名額）
+        chunks = []
+        async with async_processor.gemini_semaphore:
+            response = await self._diet_plan_model.generate_content_async(prompt, stream=True)
+            async for chunk in response:
+                if chunk.parts:
+                    chunks.append(chunk.text)
+                    yield chunk.text
+        
+        # 將結果存入快取（快取 10 分鐘）
+        nlp_cache.set(cache_key, "".join(chunks))
+        logger.info(f"已快取飲食規劃結果: {user_id}")
 
-            ## 過去7天飲食記錄
-            """
-            
-            if past_records:
-                for record in past_records:
-                    prompt += f"\n日期: {record.get('date', '未知')}, 總卡路里: {record.get('total_calories', 0)} 大卡\n"
-                    foods = record.get('foods', [])
-                    if foods:
-                        for food in foods:
-                            prompt += f"  - {food.get('name', '未知食物')}: {food.get('calories', '未知')} 大卡\n"
-                    else:
-                        prompt += "  - 無具體食物記錄\n"
+    def _build_diet_prompt(self, cal_result: Dict[str, Any], past_records: List[Dict[str, Any]],
+                           allergic_foods: List[str], user_id: str) -> str:
+        """
+        組合飲食規劃提示詞：以模板填入用戶資訊，飲食記錄逐行放入列表後一次合併
+        """
+        header = DIET_PROMPT_HEADER.format_map({
+            'user_id': user_id,
+            'bmi': cal_result.get('bmi', '未知'),
+            'bmr': cal_result.get('bmr', '未知'),
+            'daily_calories': cal_result.get('daily_calories', '未知'),
+            'weight_loss_calories': cal_result.get('weight_loss_calories', '未知'),
+            'allergic_foods': ', '.join(allergic_foods) if allergic_foods else '無'
+        })
+        
+        record_lines = []
+        for record in past_records:
+            record_lines.append(f"\n日期: {record.get('date', '未知')}, 總卡路里: {record.get('total_calories', 0)} 大卡\n")
+            foods = record.get('foods', [])
+            if foods:
+                record_lines.extend(
+                    f"  - {food.get('name', '未知食物')}: {food.get('calories', '未知')} 大卡\n" for food in foods
+                )
             else:
-                prompt += "\n暫無過去飲食記錄（新用戶）\n"
-            
-            prompt += f"""
-            
-            ## 請提供以下內容：
-            1. **未來三天飲食規劃**：
-               - 每天的早餐、午餐、晚餐建議(50字)
-               - 每餐的大概卡路里分配(50字)
-               - 考慮用戶的卡路里需求和過敏食物(50字)
-               - 如果有過去飲食記錄，請分析飲食習慣並給出改善建議(50字)
-            
-            2. **營養建議**：
-               - 基於BMI和目標，提供具體的營養建議(100字以內)
-               - 如果用戶需要減重，請提供相應的飲食策略(100字以內)
-               
-            請以友善、實用的語氣回覆，讓用戶容易理解和執行。
-            """
-            
-            # 配置並調用 Gemini
-            genai.configure(api_key=self.api_key)
-            model = genai.GenerativeModel(
-                model_name=self.model_name,
-                generation_config={"temperature": 0.7}
-            )
+                record_lines.append("  - 無具體食物記錄\n")
+        if not record_lines:
+            record_lines.append(DIET_PROMPT_NO_RECORDS)
+        
+        return "".join((header, *record_lines, DIET_PROMPT_FOOTER))
+
+    def nlpProcess(self, user_id, message_text):
+        """
+        處理聊天訊息字串的同步介面
+        在共用的背景事件迴圈上執行 anlpProcess，供既有的同步呼叫端使用
+        """
+        return async_processor.run_coroutine(self.anlpProcess(user_id, message_text))
+
+    def batch_check_intents(self, messages: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        """
+        批次意圖檢測的同步介面，供回填歷史記錄、回歸評估等非即時工作使用
+        
+        Args:
+            messages (list): (user_id, message_text) 組成的列表
             
-            # 生成回應
-            response = model.generate_content(prompt)
-            result = response.text
+        Returns:
+            list: 與 messages 順序對應的檢測結果
+        """
+        return async_processor.run_coroutine(self.abatch_check_intents(messages))
+
+    async def abatch_check_intents(self, messages: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        """
+        並行執行多則訊息的卡路里與搜索意圖檢測，以 batch_concurrency 限制同時送出的請求數
+        結果格式與 check_calorie_management_intent、check_search_intent 相同，並共用其快取
+        
+        Args:
+            messages (list): (user_id, message_text) 組成的列表
             
-            # 將結果存入快取（快取 10 分鐘）
-            nlp_cache.set(cache_key, result)
-            logger.info(f"已快取飲食規劃結果: {user_id}")
+        Returns:
+            list: 每則訊息的 {"user_id", "calorie_intent", "search_intent"}
+        """
+        semaphore = asyncio.Semaphore(self.batch_concurrency)
+        
+        async def check_message(user_id: str, message_text: str) -> Dict[str, Any]:
+            async with semaphore:
+                calorie_intent, search_intent = await asyncio.gather(
+                    self.check_calorie_management_intent(message_text),
+                    self.check_search_intent(message_text)
+                )
+            return {
+                "user_id": user_id,
+                "calorie_intent": calorie_intent,
+                "search_intent": search_intent
+            }
+        
+        results = await asyncio.gather(*(check_message(user_id, text) for user_id, text in messages))
+        logger.info(f"批次意圖檢測完成: {len(messages)} 則訊息")
+        return list(results)
+
+    def nlpProcess_batch(self, jobs: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        """
+        批次處理多則聊天訊息的同步介面
+        
+        Args:
+            jobs (list): (user_id, message_text) 組成的列表
             
-            return result
+        Returns:
+            list: 與 jobs 順序對應的處理結果
+        """
+        return async_processor.run_coroutine(self.anlpProcess_batch(jobs))
+
+    async def anlpProcess_batch(self, jobs: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        """
+        並行處理多則聊天訊息，共用同一條 Gemini 連線
+        同一用戶的訊息依序處理以維持對話歷史順序，不同用戶之間並行
+        
+        Args:
+            jobs (list): (user_id, message_text) 組成的列表
             
-        except Exception as e:
-            logger.error(f"生成飲食規劃失敗: {str(e)}")
-            return f"抱歉，生成飲食規劃時發生錯誤: {str(e)}"    @OptimizedErrorHandler(logger_name=__name__).fast_error_handler("處理您的訊息時發生錯誤，請稍後再試")
+        Returns:
+            list: 與 jobs 順序對應的處理結果
+        """
+        results: List[Optional[Dict[str, Any]]] = [None] * len(jobs)
+        jobs_by_user: Dict[str, List[int]] = {}
+        for index, (user_id, _) in enumerate(jobs):
+            jobs_by_user.setdefault(user_id, []).append(index)
+        
+        async def process_user_jobs(indexes: List[int]):
+            for index in indexes:
+                user_id, message_text = jobs[index]
+                try:
+                    results[index] = await self.anlpProcess(user_id, message_text)
+                except Exception as e:
+                    logger.error(f"批次處理用戶 {user_id} 的訊息時發生錯誤: {str(e)}")
+                    results[index] = {"result": "處理您的訊息時發生錯誤，請稍後再試"}
+        
+        await asyncio.gather(*(process_user_jobs(indexes) for indexes in jobs_by_user.values()))
+        logger.info(f"批次處理完成: {len(jobs)} 則訊息, {len(jobs_by_user)} 位用戶")
+        return results
+
+    @OptimizedErrorHandler(logger_name=__name__).fast_error_handler("處理您的訊息時發生錯誤，請稍後再試")
     @performance_monitor.timing_decorator("nlpProcess")
-    def nlpProcess(self, user_id, message_text):
+    async def anlpProcess(self, user_id, message_text):
         """
         處理聊天訊息字串，進行語義分析並回傳處理結果
         使用混合檢測架構，結合統一檢測和獨立檢測的優勢
@@ -622,27 +976,27 @@ class NLPService:
         logger.info(f"開始處理用戶 {user_id} 的訊息: {message_text}")
         
         # 使用智能意圖檢測
-        intent_result = self.smart_intent_detection(message_text)
+        intent_result = await self.smart_intent_detection(message_text)
         
         if not intent_result.get('success', False):
             logger.warning(f"意圖檢測失敗，使用一般對話處理")
-            return self._process_general_chat(user_id, message_text)
+            return await self._process_general_chat(user_id, message_text)
         
         primary_intent = intent_result.get('primary_intent')
         
         # 根據主要意圖進行相應處理
         if primary_intent == 'calorie_management':
-            return self._process_calorie_intent(user_id, message_text, intent_result)
+            return await self._process_calorie_intent(user_id, message_text, intent_result)
         elif primary_intent == 'search_history':
-            return self._process_search_intent(user_id, message_text, intent_result)
+            return await self._process_search_intent(user_id, message_text, intent_result)
         elif primary_intent == 'physical_info':
-            return self._process_physical_info_intent(user_id, message_text, intent_result)
+            return await self._process_physical_info_intent(user_id, message_text, intent_result)
         elif primary_intent == 'image_query':
             return {"result": "請上傳您要分析的食物照片，我將為您提供詳細的營養分析。"}
         else:  # general_chat
-            return self._process_general_chat(user_id, message_text)
+            return await self._process_general_chat(user_id, message_text)
 
-    def _process_calorie_intent(self, user_id: str, message_text: str, intent_result: Dict[str, Any]) -> Dict[str, Any]:
+    async def _process_calorie_intent(self, user_id: str, message_text: str, intent_result: Dict[str, Any]) -> Dict[str, Any]:
         """
         處理卡路里管理意圖
         """
@@ -653,22 +1007,21 @@ class NLPService:
         
         # 如果信心度太低，視為無意圖
         if confidence < 0.6:
-            return self._process_general_chat(user_id, message_text)
+            return await self._process_general_chat(user_id, message_text)
         
-        # 檢查用戶是否已有生理資料
-        # 使用新的方法直接通過user_id獲取身體資訊
-        phys_info_response = self.phys_info_service.get_phys_info_by_user_id(user_id)
+        # 檢查用戶是否已有生理資料（有快取時不需查詢資料庫）
+        phys_info_response = await self._get_phys_info(user_id)
         
         if phys_info_response["status"] == "success":
+            # 有生理資料才計算卡路里，查無資料時不做多餘的查詢
+            cal_result = await ConnectionFactory.run_async(self.manager_cal_service.process_user_id, user_id)
             phys_info = phys_info_response["result"]
-            # 獲取卡路里計算結果
-            cal_result = self.manager_cal_service.process_user_id(user_id)
             # 使用過敏食物資訊
             allergic_foods = phys_info.get('allergic_foods', [])
             past_records = []
             
             # 生成飲食規劃
-            planning_result = self._generate_diet_plan_with_gemini(
+            planning_result = await self._generate_diet_plan_with_gemini(
                 cal_result, past_records, allergic_foods, user_id
             )
             
@@ -683,60 +1036,162 @@ class NLPService:
         else:
             return {"result": "請提供你的性別,年齡(歲),身高(cm),體重(kg)一定要有單位,以及對什麼食物過敏"}
 
-    def _process_search_intent(self, user_id: str, message_text: str, intent_result: Dict[str, Any]) -> Dict[str, Any]:
+    async def _process_search_intent(self, user_id: str, message_text: str, intent_result: Dict[str, Any]) -> Dict[str, Any]:
         """
         處理搜索意圖
         """
         search_data = intent_result.get('search_intent', {})
         time_period = search_data.get('time_period', {})
-        return self.searchProcess(user_id, message_text, time_period)
+        return await self.searchProcess(user_id, message_text, time_period)
 
-    def _process_physical_info_intent(self, user_id: str, message_text: str, intent_result: Dict[str, Any]) -> Dict[str, Any]:
+    async def _process_physical_info_intent(self, user_id: str, message_text: str, intent_result: Dict[str, Any]) -> Dict[str, Any]:
         """
         處理生理資訊意圖
         """
-        return self.process_physical_info(user_id, message_text)
+        return await self.process_physical_info(user_id, message_text)
 
     @OptimizedErrorHandler(logger_name=__name__).fast_error_handler("一般對話處理失敗")
-    def _process_general_chat(self, user_id: str, message_text: str) -> Dict[str, Any]:
+    async def _process_general_chat(self, user_id: str, message_text: str) -> Dict[str, Any]:
         """
         處理一般對話
+        每次只送出已保存的對話歷史與新訊息
         """
-        # 檢查是否已有此用戶的對話歷史，若無則初始化
-        if user_id not in self.conversation_history:
-            # 初始化對話歷史時加入系統提示
-            model = genai.GenerativeModel(self.model_name)
-            chat = model.start_chat(history=[])
-            
-            # 將系統提示作為第一條消息添加到對話中
-            if self.chat_prompt:
-                chat.send_message(self.chat_prompt)
-            
-            self.conversation_history[user_id] = chat
-        
-        # 取得用戶的對話歷史
-        chat = self.conversation_history[user_id]
+        history = await self.conversation_store.load(user_id)
+        user_message = {"role": "user", "parts": [message_text]}
         
         # 發送訊息到 Gemini 並取得回應
-        response = chat.send_message(message_text)
+        response = await self._generate(self._chat_model, [*history, user_message])
         response_text = response.text
         
-        # 檢查回應是否為 JSON 格式
-        try:
-            # 嘗試解析回應為 JSON
-            json_response = json.loads(response_text)
-            # 如果不含 result 欄位，則加上 result 欄位
-            if "result" not in json_response:
-                json_response = {"result": response_text}
-        except json.JSONDecodeError:
-            # 若回應不是 JSON 格式，則封裝為 JSON
-            json_response = {"result": response_text}
+        model_message = {"role": "model", "parts": [response_text]}
+        await self.conversation_store.append(user_id, user_message, model_message)
+        
+        # 估算 token 超過預算時，於背景將較舊的訊息摘要壓縮
+        self._schedule_history_compaction(user_id, [*history, user_message, model_message][-self.max_history_messages:])
+        
+        # 檢查回應是否為 JSON 物件，大多數純文字回應以首尾字元即可排除，不需嘗試解析
+        json_response = {"result": response_text}
+        stripped = response_text.strip()
+        if stripped.startswith('{') and stripped.endswith('}'):
+            try:
+                parsed_response = json.loads(stripped)
+                # 只有包含 result 欄位時才採用解析結果
+                if "result" in parsed_response:
+                    json_response = parsed_response
+            except json.JSONDecodeError:
+                pass
         
         logger.info(f"一般對話處理完成")
         return json_response
     
+    def _schedule_history_compaction(self, user_id: str, history: List[Dict[str, Any]]) -> None:
+        """
+        粗略估算對話歷史的 token 數（約 4 個字元一個 token），
+        超過預算時建立背景任務進行摘要壓縮，不阻塞本次回覆
+        """
+        estimated_tokens = sum(len(part) for message in history for part in message["parts"]) // 4
+        if estimated_tokens <= self.history_token_budget:
+            return
+        
+        self._run_in_background(self._compact_history(user_id, history))
+    
+    async def _generate(self, model, *args, **kwargs):
+        """
+        呼叫 Gemini 產生內容，並以共用的信號量限制同時送出的請求數，避免突發流量觸發配額限制
+        """
+        async with async_processor.gemini_semaphore:
+            return await model.generate_content_async(*args, **kwargs)
+    
+    def _run_in_background(self, coro) -> None:
+        """
+        在目前的事件迴圈上建立背景任務，並保留引用直到完成
+        """
+        task = asyncio.ensure_future(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+    
+    def _enqueue_search_history(self, user_id: str, message_text: str, search_result: str) -> None:
+        """
+        將搜索請求與結果放入用戶的待寫入佇列，第一次使用時啟動該用戶的寫入任務
+        """
+        queue = self._history_queues.get(user_id)
+        if queue is None:
+            queue = asyncio.Queue(maxsize=self.history_queue_size)
+            self._history_queues[user_id] = queue
+            self._run_in_background(self._search_history_writer(user_id, queue))
+        
+        try:
+            queue.put_nowait((message_text, search_result))
+        except asyncio.QueueFull:
+            logger.warning(f"用戶 {user_id} 的搜索對話歷史佇列已滿，捨棄本次紀錄")
+    
+    async def _search_history_writer(self, user_id: str, queue: asyncio.Queue) -> None:
+        """
+        用戶的單一寫入任務：一次取出最多 history_batch_size 筆合併寫入，閒置逾時後結束
+        """
+        try:
+            while True:
+                try:
+                    entry = await asyncio.wait_for(queue.get(), timeout=self.history_writer_idle)
+                except asyncio.TimeoutError:
+                    break
+                
+                entries = [entry]
+                while len(entries) < self.history_batch_size and not queue.empty():
+                    entries.append(queue.get_nowait())
+                await self._append_search_history(user_id, entries)
+        finally:
+            # 逾時與移除之間沒有 await，不會有新的紀錄放進即將被丟棄的佇列
+            if self._history_queues.get(user_id) is queue:
+                del self._history_queues[user_id]
+    
+    async def _append_search_history(self, user_id: str, entries: List[Tuple[str, str]]) -> None:
+        """
+        用戶已有對話歷史時，將多筆搜索請求與結果一次加入對話歷史
+        """
+        try:
+            if await self.conversation_store.exists(user_id):
+                messages = []
+                for message_text, search_result in entries:
+                    messages.append({"role": "user", "parts": [f"用戶搜索請求: {message_text}"]})
+                    messages.append({"role": "model", "parts": [f"系統搜索結果: {search_result}"]})
+                await self.conversation_store.append(user_id, *messages)
+        except Exception as e:
+            logger.warning(f"寫入搜索對話歷史失敗: {str(e)}")
+    
+    async def _compact_history(self, user_id: str, history: List[Dict[str, Any]]) -> None:
+        """
+        將對話歷史中較舊的一半訊息摘要成一組摘要訊息
+        """
+        compact_size = (len(history) // 2) & ~1  # 保持 user/model 成對
+        if compact_size < 4:
+            return
+        
+        older = history[:compact_size]
+        summary = await self._summarize_history(older)
+        if not summary:
+            return
+        
+        # 摘要期間對話可能已被新訊息推動，舊訊息已不在開頭時由儲存端放棄本次壓縮
+        await self.conversation_store.compact(user_id, older, [
+            {"role": "user", "parts": [f"先前對話摘要：{summary}"]},
+            {"role": "model", "parts": ["好的，我會參考先前的對話內容。"]},
+        ])
+    
+    async def _summarize_history(self, messages: List[Dict[str, Any]]) -> Optional[str]:
+        """
+        將較舊的對話訊息摘要成一段文字
+        """
+        transcript = "\n".join(f"{message['role']}: {''.join(message['parts'])}" for message in messages)
+        try:
+            response = await self._generate(self._default_model, f"請用100字以內摘要以下對話的重點：\n\n{transcript}")
+            return response.text.strip()
+        except Exception as e:
+            logger.warning(f"對話歷史摘要失敗: {str(e)}")
+            return None
 
-    def process_physical_info(self, user_id: str, message_text: str) -> Dict[str, Any]:
+
+    async def process_physical_info(self, user_id: str, message_text: str) -> Dict[str, Any]:
         """
         處理用戶輸入的生理資訊，將其存儲到資料庫並進行卡路里計算
         
@@ -751,46 +1206,24 @@ class NLPService:
             logger.info(f"開始處理用戶 {user_id} 的生理資訊: {message_text}")
             
             # 使用 Gemini 進行訊息解析，利用 function calling
-            model = genai.GenerativeModel(
-                model_name=self.model_name,
-                generation_config={"temperature": 0.2}
-            )
-            
-            # 設置 function calling
-            tools = [
-                {
-                    "function_declarations": [self.phys_info_function],
-                }
-            ]
-            
-            response = model.generate_content(
-                f"從以下用戶訊息中提取身體資訊（性別、年齡、身高、體重、過敏食物）：\n\n{message_text}",
-                tools=tools
+            response = await self._generate(
+                self._phys_info_model,
+                f"從以下用戶訊息中提取身體資訊（性別、年齡、身高、體重、過敏食物）：\n\n{message_text}"
             )
             
             # 提取 function calling 結果
-            function_response = None
-            for part in response.parts:
-                if hasattr(part, 'function_call'):
-                    function_response = part.function_call
-                    break
+            args = self._extract_function_args(response, "extract_physical_info")
             
-            if function_response and function_response.name == "extract_physical_info":
-                # 使用 function_response.args 直接作為結果，轉換為普通字典
-                result = dict(function_response.args)
-
-                # 確保過敏食物是列表，並轉成普通 list
-                allergic_foods = result.get("allergic_foods", [])
-                if hasattr(allergic_foods, '__iter__') and not isinstance(allergic_foods, str):
-                    allergic_foods = list(allergic_foods)
-                else:
-                    allergic_foods = []
+            if args is not None:
+                result = self._physical_info_from_args(args)
+                allergic_foods = result["allergic_foods"]
                 
                 # 記錄過敏食物信息
                 logger.info(f"用戶 {user_id} 報告的過敏食物: {allergic_foods}")
 
                 # 使用 PhysInfoDataService 存儲資訊，包含過敏食物
-                create_result = self.phys_info_service.create_phys_info(
+                create_result = await ConnectionFactory.run_async(
+                    self.phys_info_service.create_phys_info,
                     master_id=user_id,
                     gender=result["gender"],
                     age=result["age"],
@@ -800,9 +1233,11 @@ class NLPService:
                 )
                 
                 if create_result.get("status") == "success":
+                    # 生理資料已更新，清除先前快取的查詢結果
+                    self._invalidate_phys_info(user_id)
                     # 成功儲存後，調用 ManagerCalService 進行計算，並生成未來三天飲食規劃
                     logger.info(f"用戶 {user_id} 生理資訊儲存成功，開始生成飲食規劃")
-                    return self.generate_diet_planning_for_new_user(user_id)
+                    return await self.generate_diet_planning_for_new_user(user_id)
                 else:
                     return {
                         "result": "資料儲存失敗，請稍後再試",
@@ -817,8 +1252,7 @@ class NLPService:
                 
         except Exception as e:
             error_msg = f"處理生理資訊時發生錯誤: {str(e)}"
-            logger.error(error_msg)
-            logger.error(traceback.format_exc())
+            self.error_handler.log_exception(error_msg, e)
             return {
                 "result": error_msg,
                 "status": "error"
@@ -838,73 +1272,55 @@ class NLPService:
         try:
             logger.info(f"開始解析身體資訊: {message_text}")
             
-            # 使用 Gemini 進行訊息解析，利用 function calling
-            model = genai.GenerativeModel(
-                model_name=self.model_name,
-                generation_config={"temperature": 0.2}
-            )
-            
-            # 設置 function calling
-            tools = [
-                {
-                    "function_declarations": [self.phys_info_function],
-                }
-            ]
+            # 檢查快取
+            cache_key = self._intent_cache_key("phys_parse", message_text)
+            cached_result = nlp_cache.get(cache_key)
+            if cached_result:
+                logger.info(f"使用快取的身體資訊解析結果: {message_text[:30]}...")
+                return cached_result
             
-            response = model.generate_content(
-                f"從以下用戶訊息中提取身體資訊（性別、年齡、身高、體重、過敏食物）：\n\n{message_text}",
-                tools=tools
+            # 使用 Gemini 進行訊息解析，利用 function calling
+            response = self._phys_info_model.generate_content(
+                f"從以下用戶訊息中提取身體資訊（性別、年齡、身高、體重、過敏食物）：\n\n{message_text}"
             )
             
             # 提取 function calling 結果
-            function_response = None
-            for part in response.parts:
-                if hasattr(part, 'function_call'):
-                    function_response = part.function_call
-                    break
+            args = self._extract_function_args(response, "extract_physical_info")
             
-            if function_response and function_response.name == "extract_physical_info":
-                # 使用 function_response.args 直接作為結果，轉換為普通字典
-                result = dict(function_response.args)
-
-                # 確保過敏食物是列表，並轉成普通 list
-                allergic_foods = result.get("allergic_foods", [])
-                if hasattr(allergic_foods, '__iter__') and not isinstance(allergic_foods, str):
-                    allergic_foods = list(allergic_foods)
-                else:
-                    allergic_foods = []
-                
-                # 更新結果字典
-                result["allergic_foods"] = allergic_foods
+            if args is not None:
+                # 只取出需要的欄位，過敏食物轉成普通 list
+                result = self._physical_info_from_args(args)
                 
+                # 將結果存入快取
+                nlp_cache.set(cache_key, result)
                 return result
             else:
                 # 如果 Gemini 無法解析，則嘗試使用正則表達式
                 result = {}
                 
                 # 匹配性別
-                gender_match = re.search(r'(男|女)(?:性)?', message_text)
+                gender_match = _GENDER_RE.search(message_text)
                 if gender_match:
                     gender = gender_match.group(1)
                     result["gender"] = "男性" if gender == "男" else "女性"
                 
                 # 匹配年齡
-                age_match = re.search(r'(\d+)(?:歲|岁)', message_text)
+                age_match = _AGE_RE.search(message_text)
                 if age_match:
                     result["age"] = int(age_match.group(1))
                 
                 # 匹配身高
-                height_match = re.search(r'(\d+(?:\.\d+)?)(?:公分|cm|CM)', message_text)
+                height_match = _HEIGHT_RE.search(message_text)
                 if height_match:
                     result["height"] = float(height_match.group(1))
                 
                 # 匹配體重
-                weight_match = re.search(r'(\d+(?:\.\d+)?)(?:kg|KG|公斤)', message_text)
+                weight_match = _WEIGHT_RE.search(message_text)
                 if weight_match:
                     result["weight"] = float(weight_match.group(1))
                 
                 # 匹配過敏食物
-                allergic_match = re.search(r'(.+)(?:過敏|过敏)', message_text)
+                allergic_match = _ALLERGIC_RE.search(message_text)
                 if allergic_match:
                     allergic_foods = allergic_match.group(1).strip()
                     result["allergic_foods"] = [allergic_foods]
@@ -919,11 +1335,10 @@ class NLPService:
                 
         except Exception as e:
             error_msg = f"解析身體資訊時發生錯誤: {str(e)}"
-            logger.error(error_msg)
-            logger.error(traceback.format_exc())
+            self.error_handler.log_exception(error_msg, e)
             return None
 
-    def searchProcess(self, user_id: str, message_text: str, time_period: Dict[str, Any] = None) -> Dict[str, Any]:
+    async def searchProcess(self, user_id: str, message_text: str, time_period: Dict[str, Any] = None) -> Dict[str, Any]:
         """
         處理搜索食物歷史記錄的請求，使用 chatSearchPrompt 系統提示進行語意解析，
         從資料庫獲取相關數據，並使用 FoodDataService 的 get_total_calories_by_date 方法進行處理
@@ -941,30 +1356,20 @@ class NLPService:
             
             # 從 time_period 中提取日期信息
             date_info = None
-            if time_period:
-                period_type = time_period.get("period_type")
+            period_type = time_period.get("period_type") if time_period else None
+            days_back = _PERIOD_DAYS_BACK.get(period_type)
+            if days_back is not None:
                 today = datetime.date.today()
-                
-                if period_type == "today":
-                    date_info = today
-                elif period_type == "yesterday":
-                    date_info = today - datetime.timedelta(days=1)
-                elif period_type == "this_week":
-                    # 計算本週的起始日期（週一）
-                    start_of_week = today - datetime.timedelta(days=today.weekday())
-                    date_info = start_of_week  # 或者可以返回一個日期範圍
-                elif period_type == "last_week":
-                    # 計算上週的起始日期
-                    start_of_last_week = today - datetime.timedelta(days=today.weekday() + 7)
-                    date_info = start_of_last_week  # 或者可以返回一個日期範圍
-                elif period_type == "specific_date":
-                    # 使用指定的日期
-                    start_date = time_period.get("start_date")
-                    if start_date:
-                        try:
-                            date_info = datetime.date.fromisoformat(start_date)
-                        except ValueError:
-                            logger.warning(f"無效的日期格式: {start_date}")
+                offset = days_back(today)
+                date_info = today - datetime.timedelta(days=offset) if offset else today
+            elif period_type == "specific_date":
+                # 使用指定的日期
+                start_date = time_period.get("start_date")
+                if start_date:
+                    try:
+                        date_info = datetime.date.fromisoformat(start_date)
+                    except ValueError:
+                        logger.warning(f"無效的日期格式: {start_date}")
             
             # 如果沒有從 function calling 獲取到日期，嘗試從消息中提取
             if not date_info:
@@ -976,12 +1381,12 @@ class NLPService:
                 logger.info(f"未找到明確的日期信息，使用今天的日期: {date_info}")
             
             # 查詢該日期的總卡路里
-            total_calories = self.food_data_service.get_total_calories_by_date(user_id, date_info)
+            total_calories = await ConnectionFactory.run_async(self.food_data_service.get_total_calories_by_date, user_id, date_info)
             
             # 判斷用戶是否有飲食記錄，如果沒有，直接生成飲食規劃
             if not total_calories:
                 logger.info(f"用戶 {user_id} 在 {date_info} 沒有飲食記錄，直接生成飲食規劃")
-                planning_result = self.generate_diet_planning_for_new_user(user_id)
+                planning_result = await self.generate_diet_planning_for_new_user(user_id)
                 planning_result["result"] = f"您在 {date_info.isoformat() if isinstance(date_info, datetime.date) else date_info} 沒有飲食記錄。\n\n為您生成的飲食規劃：\n{planning_result.get('result', '')}"
                 return planning_result
             
@@ -996,29 +1401,89 @@ class NLPService:
             # 使用 chatSearchPrompt 進行數據分析和建議生成
             search_prompt = f"{self.chat_search_prompt}\n\n用戶ID: {user_id}\n日期: {search_data['date']}\n總卡路里: {total_calories}\n用戶訊息: {message_text}"
             
-            # 使用新的 model 實例來生成搜索結果
-            model = genai.GenerativeModel(self.model_name)
-            search_response = model.generate_content(search_prompt)
+            # 使用共用的模型實例生成搜索結果
+            search_response = await self._generate(self._default_model, search_prompt)
             search_result = search_response.text.strip()
             
             logger.info(f"搜索分析結果: {search_result}")
             
-            # 如果用戶有對話歷史，將搜索結果添加到對話歷史中
-            if user_id in self.conversation_history:
-                chat = self.conversation_history[user_id]
-                chat.send_message(f"用戶搜索請求: {message_text}")
-                chat.send_message(f"系統搜索結果: {search_result}")
+            # 如果用戶有對話歷史，於背景將搜索結果加入對話歷史，不延遲回覆
+            self._enqueue_search_history(user_id, message_text, search_result)
             
             # 返回結果
             return {"result": search_result}
             
         except Exception as e:
             error_msg = f"搜索處理過程中發生錯誤: {str(e)}"
-            logger.error(error_msg)
-            logger.error(traceback.format_exc())
+            self.error_handler.log_exception(error_msg, e)
             return {"result": f"處理您的搜索請求時發生錯誤: {str(e)}"}
 
     def process_image_analysis(self, user_id: str, image_analysis: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        處理圖片分析結果的同步介面
+        在共用的背景事件迴圈上執行 aprocess_image_analysis，供控制器使用
+        """
+        return async_processor.run_coroutine(self.aprocess_image_analysis(user_id, image_analysis))
+
+    @staticmethod
+    def _summarize_image_analysis(image_analysis: Dict[str, Any]) -> Tuple[str, List[str], Any]:
+        """
+        取出圖片分析的餐點類型、食物項目清單與總卡路里（食物清單只走訪一次，摘要與回覆訊息共用）
+        """
+        intent = image_analysis.get('intent', '未知餐點')
+        items = image_analysis.get('item', [])
+        total_cal = image_analysis.get('本餐共攝取', '未知')
+        
+        food_lines = []
+        if isinstance(items, list):
+            food_lines = [
+                f"{idx}. {item.get('desc', '未知食物')} : {item.get('cal', '未知卡路里')}"
+                for idx, item in enumerate(items, 1)
+            ]
+        return intent, food_lines, total_cal
+
+    @staticmethod
+    def _format_image_analysis_message(intent: str, food_lines: List[str], total_cal: Any,
+                                       suggestion: Optional[str] = None) -> str:
+        """組合圖片分析的回覆訊息，有營養建議時附加在最後"""
+        message_lines = [f"🍽️ 已分析您的【{intent}】照片\n"]
+        if food_lines:
+            message_lines.append("🔍 識別出的食物：")
+            message_lines.extend(food_lines)
+            if total_cal != '未知':
+                message_lines.append(f"\n📊 本餐共攝取：{total_cal}")
+        else:
+            message_lines.append("無法識別食物內容")
+        
+        if suggestion is not None:
+            message_lines.append(f"\n💡 營養建議：\n{suggestion}")
+        
+        return "\n".join(message_lines)
+
+    async def _generate_image_suggestion(self, intent: str, food_lines: List[str], total_cal: Any) -> str:
+        """
+        使用 imageProcessReplyprompt 系統提示，依食物分析產生餐點評價和營養建議
+        """
+        food_items_summary = "\n".join(food_lines) if food_lines else "無法識別食物內容"
+        
+        # 構建提示給LLM
+        user_prompt = f"""
+            用戶拍攝了一張【{intent}】的照片，分析結果如下：
+            
+            識別出的食物：
+            {food_items_summary}
+            
+            本餐共攝取：{total_cal}
+            
+            請根據上述食物分析，提供簡短的餐點評價和營養建議。如果這是一個正餐(早餐、午餐或晚餐)，
+            請指出最多兩項缺少營養素或食物種類，並給予鼓勵。總文長300字。
+            """
+        
+        # 獲取 LLM 回應（圖片處理回覆系統提示已設定於模型的 system_instruction）
+        response = await self._generate(self._image_reply_model, user_prompt)
+        return response.text
+
+    async def aprocess_image_analysis(self, user_id: str, image_analysis: Dict[str, Any]) -> Dict[str, Any]:
         """
         處理圖片分析結果，使用 imageProcessReplyprompt 系統提示，
         提供關於食物分析的進一步建議和評論
@@ -1040,83 +1505,69 @@ class NLPService:
                     "status": "error"
                 }
             
-            # 初始化一個新的對話，使用圖片處理回覆系統提示
-            model = genai.GenerativeModel(self.model_name)
-            chat = model.start_chat(history=[])
-            
-            # 加入系統提示
-            if self.image_process_reply_prompt:
-                chat.send_message(self.image_process_reply_prompt)
-            
-            # 準備提供給LLM的食物分析摘要
-            intent = image_analysis.get('intent', '未知餐點')
-            items = image_analysis.get('item', [])
-            total_cal = image_analysis.get('本餐共攝取', '未知')
-            
-            # 生成食物項目摘要
-            food_items_summary = ""
-            if isinstance(items, list) and items:
-                for idx, item in enumerate(items, 1):
-                    desc = item.get('desc', '未知食物')
-                    cal = item.get('cal', '未知卡路里')
-                    food_items_summary += f"{idx}. {desc} : {cal}\n"
-            else:
-                food_items_summary = "無法識別食物內容"
-            
-            # 構建提示給LLM
-            user_prompt = f"""
-            用戶拍攝了一張【{intent}】的照片，分析結果如下：
-            
-            識別出的食物：
-            {food_items_summary}
-            
-            本餐共攝取：{total_cal}
-            
-            請根據上述食物分析，提供簡短的餐點評價和營養建議。如果這是一個正餐(早餐、午餐或晚餐)，
-            請指出最多兩項缺少營養素或食物種類，並給予鼓勵。總文長300字。
-            """
-            
-            # 獲取 LLM 回應
-            response = chat.send_message(user_prompt)
-            response_text = response.text
+            intent, food_lines, total_cal = self._summarize_image_analysis(image_analysis)
+            response_text = await self._generate_image_suggestion(intent, food_lines, total_cal)
             
             # 合併原始分析結果和進一步建議
             enhanced_analysis = image_analysis.copy()  # 複製原始分析
             enhanced_analysis['nlp_suggestion'] = response_text  # 添加NLP建議
             
             # 為了向後兼容，也添加 result 字段
-            result_message = f"🍽️ 已分析您的【{intent}】照片\n\n"
-            
-            if isinstance(items, list) and items:
-                result_message += "🔍 識別出的食物：\n"
-                for idx, item in enumerate(items, 1):
-                    desc = item.get('desc', '未知食物')
-                    cal = item.get('cal', '未知卡路里')
-                    result_message += f"{idx}. {desc} : {cal}\n"
-                
-                if total_cal != '未知':
-                    result_message += f"\n📊 本餐共攝取：{total_cal}\n"
-            else:
-                result_message += "無法識別食物內容\n"
-            
-            # 添加NLP建議
-            result_message += f"\n💡 營養建議：\n{response_text}"
-            
-            enhanced_analysis['result'] = result_message
+            enhanced_analysis['result'] = self._format_image_analysis_message(intent, food_lines, total_cal, response_text)
             
             logger.info(f"圖片分析結果處理完成: {enhanced_analysis}")
             return enhanced_analysis
             
         except Exception as e:
             error_msg = f"處理圖片分析結果時發生錯誤: {str(e)}"
-            logger.error(error_msg)
-            logger.error(traceback.format_exc())
+            self.error_handler.log_exception(error_msg, e)
             return {
                 "result": f"處理您的圖片分析結果時發生錯誤: {str(e)}",
                 "status": "error"
             }
+
+    def process_image_analysis_fast(self, user_id: str, image_analysis: Dict[str, Any],
+                                    deliver_suggestion: Callable[[str], Any]) -> Dict[str, Any]:
+        """
+        立即返回圖片分析的回覆訊息（不含營養建議），營養建議改在背景產生後交給 deliver_suggestion 送出
+        用戶不必等待 LLM 產生建議即可看到分析結果
+        
+        Args:
+            user_id (str): 用戶ID
+            image_analysis (dict): 圖片分析結果，包含 intent 和 item 等信息
+            deliver_suggestion (callable): 接收營養建議文字的同步函數（例如推播 LINE 訊息），於工作線程執行
+            
+        Returns:
+            dict: 原始分析加上 result 字段的JSON物件
+        """
+        if not isinstance(image_analysis, dict):
+            return {
+                "result": "無效的圖片分析格式",
+                "status": "error"
+            }
+        
+        intent, food_lines, total_cal = self._summarize_image_analysis(image_analysis)
+        enhanced_analysis = image_analysis.copy()
+        enhanced_analysis['result'] = self._format_image_analysis_message(intent, food_lines, total_cal)
+        
+        async_processor.submit_coroutine(
+            self._deliver_image_suggestion(user_id, intent, food_lines, total_cal, deliver_suggestion)
+        )
+        return enhanced_analysis
+
+    async def _deliver_image_suggestion(self, user_id: str, intent: str, food_lines: List[str], total_cal: Any,
+                                        deliver_suggestion: Callable[[str], Any]) -> None:
+        """
+        背景產生營養建議並交給 deliver_suggestion 送出
+        """
+        try:
+            suggestion = await self._generate_image_suggestion(intent, food_lines, total_cal)
+            await asyncio.to_thread(deliver_suggestion, f"💡 營養建議：\n{suggestion}")
+            logger.info(f"用戶 {user_id} 的營養建議已送出")
+        except Exception as e:
+            self.error_handler.log_exception(f"產生用戶 {user_id} 的營養建議時發生錯誤: {str(e)}", e)
     
-    def check_calorie_management_intent(self, message_text: str) -> Dict[str, Any]:
+    async def check_calorie_management_intent(self, message_text: str) -> Dict[str, Any]:
         """
         使用 function calling 檢查用戶訊息是否有卡路里管理意圖
         包含快取機制以提高響應速度
@@ -1130,9 +1581,17 @@ class NLPService:
         try:
             logger.info(f"開始檢查訊息是否有卡路里管理意圖: {message_text}")
             
+            # 本地預篩選：不含任何卡路里管理相關字詞時不呼叫 Gemini
+            if _CALORIE_HINTS.search(message_text) is None:
+                logger.info("預篩選未發現卡路里管理相關字詞")
+                return {
+                    "has_calorie_intent": False,
+                    "intent_type": "none",
+                    "confidence": 0.0
+                }
+            
             # 生成快取鍵值
-            import hashlib
-            cache_key = f"calorie_intent_{hashlib.md5(message_text.encode()).hexdigest()}"
+            cache_key = self._intent_cache_key("calorie_intent", message_text)
             
             # 檢查快取
             cached_result = nlp_cache.get(cache_key)
@@ -1141,18 +1600,6 @@ class NLPService:
                 return cached_result
             
             # 使用 Gemini 進行意圖解析
-            model = genai.GenerativeModel(
-                model_name=self.model_name,
-                generation_config={"temperature": 0.2}
-            )
-            
-            # 設置 function calling
-            tools = [
-                {
-                    "function_declarations": [self.calorie_intent_function],
-                }
-            ]
-            
             prompt = f"""
             分析以下用戶訊息，判斷是否包含卡路里管理、減重計劃、飲食控制或健康管理的意圖。
             
@@ -1166,18 +1613,18 @@ class NLPService:
             用戶訊息：{message_text}
             """
             
-            response = model.generate_content(prompt, tools=tools)
+            response = await self._generate(self._calorie_intent_model, prompt)
             
             # 提取 function calling 結果
-            function_response = None
-            for part in response.parts:
-                if hasattr(part, 'function_call'):
-                    function_response = part.function_call
-                    break
-            
-            if function_response and function_response.name == "detect_calorie_management_intent":
-                # 使用 function_response.args 直接作為結果
-                result = dict(function_response.args)  # 轉換為普通字典
+            args = self._extract_function_args(response, "detect_calorie_management_intent")
+            
+            if args is not None:
+                # 只複製需要的欄位
+                result = {
+                    "has_calorie_intent": args.get("has_calorie_intent", False),
+                    "intent_type": args.get("intent_type", "none"),
+                    "confidence": args.get("confidence", 0.0)
+                }
                 
                 # 將結果存入快取（快取 10 分鐘）
                 nlp_cache.set(cache_key, result)
@@ -1196,8 +1643,7 @@ class NLPService:
                 
         except Exception as e:
             error_msg = f"檢查卡路里管理意圖時發生錯誤: {str(e)}"
-            logger.error(error_msg)
-            logger.error(traceback.format_exc())
+            self.error_handler.log_exception(error_msg, e)
             return {
                 "has_calorie_intent": False,
                 "intent_type": "none", 
@@ -1205,7 +1651,7 @@ class NLPService:
                 "error": str(e)
             }
 #TODO 意圖重複？？_process_search_intent
-    def check_search_intent(self, message_text: str) -> Dict[str, Any]:
+    async def check_search_intent(self, message_text: str) -> Dict[str, Any]:
         """
         使用 function calling 檢查用戶訊息是否有搜索意圖
         
@@ -1218,44 +1664,45 @@ class NLPService:
         try:
             logger.info(f"開始檢查訊息是否有搜索意圖: {message_text}")
             
-            # 使用 Gemini 進行意圖解析
-            model = genai.GenerativeModel(
-                model_name=self.model_name,
-                generation_config={"temperature": 0.2}
-            )
+            # 本地預篩選：不含任何時間或飲食記錄相關字詞時不呼叫 Gemini
+            if _SEARCH_HINTS.search(message_text) is None:
+                logger.info("預篩選未發現搜索相關字詞")
+                return {"has_search_intent": False}
             
-            # 設置 function calling
-            tools = [
-                {
-                    "function_declarations": [self.search_intent_function],
-                }
-            ]
+            # 檢查快取
+            cache_key = self._intent_cache_key("search_intent", message_text)
+            cached_result = nlp_cache.get(cache_key)
+            if cached_result:
+                logger.info(f"使用快取的搜索意圖檢測結果: {message_text[:30]}...")
+                return cached_result
             
-            response = model.generate_content(
-                f"從以下用戶訊息中判斷是否包含搜索食物歷史或查詢卡路里攝取量的意圖，並提取相關時間範圍：\n\n{message_text}",
-                tools=tools
+            # 使用 Gemini 進行意圖解析，利用 function calling
+            response = await self._generate(
+                self._search_intent_model,
+                f"從以下用戶訊息中判斷是否包含搜索食物歷史或查詢卡路里攝取量的意圖，並提取相關時間範圍：\n\n{message_text}"
             )
             
             # 提取 function calling 結果
-            function_response = None
-            for part in response.parts:
-                if hasattr(part, 'function_call'):
-                    function_response = part.function_call
-                    break
+            args = self._extract_function_args(response, "extract_search_intent")
             
-            if function_response and function_response.name == "extract_search_intent":
-                # 使用 function_response.args 直接作為結果
-                result = dict(function_response.args)  # 轉換為普通字典
+            if args is None:
+                logger.info("未檢測到搜索意圖")
+                result = {"has_search_intent": False}
+            else:
+                # 只複製需要的欄位，time_period 轉成普通 dict 一次
+                result = {"has_search_intent": args.get("has_search_intent", False)}
+                time_period = args.get("time_period")
+                if time_period is not None:
+                    result["time_period"] = {key: time_period[key] for key in time_period}
                 logger.info(f"檢測到搜索意圖: {result}")
-                return result
             
-            logger.info("未檢測到搜索意圖")
-            return {"has_search_intent": False}
+            # 將結果存入快取（未檢測到意圖的結果也要快取）
+            nlp_cache.set(cache_key, result)
+            return result
                 
         except Exception as e:
             error_msg = f"檢查搜索意圖時發生錯誤: {str(e)}"
-            logger.error(error_msg)
-            logger.error(traceback.format_exc())
+            self.error_handler.log_exception(error_msg, e)
             return {"has_search_intent": False}
     
     def _extract_date_from_message(self, message_text: str) -> Optional[datetime.date]:
@@ -1268,54 +1715,36 @@ class NLPService:
         Returns:
             datetime.date or None: 提取到的日期，如果無法提取則返回 None
         """
+        # 快速預篩：沒有相對日期的開頭字元也沒有數字時直接返回
+        if _DATE_LEADING_CHARS.isdisjoint(message_text) and _NUMBER_RE.search(message_text) is None:
+            return None
+        
         today = datetime.date.today()
         
-        # 匹配完整日期格式，如 "2023-01-01", "2023/01/01", "2023.01.01"
-        date_pattern = r'(\d{4})[-/.](\d{1,2})[-/.](\d{1,2})'
-        full_date_match = re.search(date_pattern, message_text)
-        if full_date_match:
-            try:
-                year = int(full_date_match.group(1))
-                month = int(full_date_match.group(2))
-                day = int(full_date_match.group(3))
-                return datetime.date(year, month, day)
-            except ValueError:
-                logger.warning("日期格式無效")
-        
-        # 匹配部分日期，如 "3月1日", "3-1", "3/1"
-        partial_date_pattern = r'(\d{1,2})[-/月](\d{1,2})[日號]?'
-        partial_date_match = re.search(partial_date_pattern, message_text)
-        if partial_date_match:
-            try:
-                month = int(partial_date_match.group(1))
-                day = int(partial_date_match.group(2))
-                if 1 <= month <= 12 and 1 <= day <= 31:
-                    return datetime.date(today.year, month, day)
-            except ValueError:
-                logger.warning("部分日期格式無效")
-        
-        # 匹配相對日期，如 "昨天", "今天", "前天"
-        if "今天" in message_text or "今日" in message_text:
-            return today
-        elif "昨天" in message_text or "昨日" in message_text:
-            return today - datetime.timedelta(days=1)
-        elif "前天" in message_text:
-            return today - datetime.timedelta(days=2)
-        elif "上週" in message_text or "上星期" in message_text:
-            return today - datetime.timedelta(days=7)
-        elif "上個月" in message_text:
-            # 簡單處理，減去30天
-            return today - datetime.timedelta(days=30)
-        
-        # 匹配數字+天前，如 "3天前"
-        days_ago_pattern = r'(\d+)天前'
-        days_ago_match = re.search(days_ago_pattern, message_text)
-        if days_ago_match:
-            try:
-                days = int(days_ago_match.group(1))
-                return today - datetime.timedelta(days=days)
-            except ValueError:
-                logger.warning("天數格式無效")
+        # 單次掃描找出所有日期片段，依優先順序（完整日期 > 部分日期 > 相對日期 > N天前）取第一個有效的
+        matches = sorted(_DATE_SCAN_RE.finditer(message_text), key=lambda match: _DATE_MATCH_PRIORITY[match.lastgroup])
+        for match in matches:
+            kind = match.lastgroup
+            if kind == "full":
+                try:
+                    return datetime.date(int(match.group("year")), int(match.group("month")), int(match.group("day")))
+                except ValueError:
+                    logger.warning("日期格式無效")
+            elif kind == "partial":
+                try:
+                    month = int(match.group("p_month"))
+                    day = int(match.group("p_day"))
+                    if 1 <= month <= 12 and 1 <= day <= 31:
+                        return datetime.date(today.year, month, day)
+                except ValueError:
+                    logger.warning("部分日期格式無效")
+            elif kind == "days_ago":
+                try:
+                    return today - datetime.timedelta(days=int(match.group("days")))
+                except (ValueError, OverflowError):
+                    logger.warning("天數格式無效")
+            else:
+                return today - datetime.timedelta(days=_RELATIVE_DAYS_BACK[kind])
         
         # 如果都無法匹配，返回 None
         return None
@@ -1330,19 +1759,17 @@ class NLPService:
         Returns:
             bool: 是否包含完整的生理資訊
         """
-        gender_keywords = ["男", "女", "性別"]
-        age_keywords = ["歲", "岁", "年齡", "年紀"]
-        height_keywords = ["身高", "公分", "cm", "CM"]
-        weight_keywords = ["體重", "公斤", "kg", "KG"]
-        
-        has_gender = any(keyword in message_text for keyword in gender_keywords)
-        has_age = any(keyword in message_text for keyword in age_keywords)
-        has_height = any(keyword in message_text for keyword in height_keywords)
-        has_weight = any(keyword in message_text for keyword in weight_keywords)
-        
-        # 簡單地檢查是否同時包含這四類關鍵詞，以及是否包含數字
-        contains_numbers = bool(re.search(r'\d+', message_text))
-        return has_gender and has_age and has_height and has_weight and contains_numbers
+        # 快速預篩：沒有任何性別相關字元時不需要執行正則
+        if _PHYSICAL_GENDER_CHARS.isdisjoint(message_text):
+            return False
+        
+        # 單次掃描收集命中的類別，需同時包含四類關鍵詞以及數字（全部命中即提早結束）
+        found = set()
+        for match in _PHYSICAL_SCAN_RE.finditer(message_text):
+            found.add(match.lastgroup)
+            if len(found) == len(_PHYSICAL_SCAN_CATEGORIES):
+                return True
+        return False
 
     def get_detection_stats(self) -> Dict[str, Any]:
         """
@@ -1352,11 +1779,12 @@ class NLPService:
             dict: 統計資訊
         """
         # 這裡可以添加統計邏輯，追蹤不同檢測方法的使用情況
+        detection_config = self._detection_config
         return {
-            "unified_detection_enabled": self.enable_unified_detection,
-            "fallback_enabled": self.fallback_to_individual,
-            "confidence_threshold": self.unified_confidence_threshold,
-            "last_detection_method": getattr(self, '_last_detection_method', 'unknown')
+            "unified_detection_enabled": detection_config.enable_unified_detection,
+            "fallback_enabled": detection_config.fallback_to_individual,
+            "confidence_threshold": detection_config.unified_confidence_threshold,
+            "last_detection_method": self._last_detection_method
         }
 
     def configure_detection_method(self, 
@@ -1374,29 +1802,22 @@ class NLPService:
         Returns:
             dict: 配置結果
         """
-        old_config = {
-            "enable_unified_detection": self.enable_unified_detection,
-            "fallback_to_individual": self.fallback_to_individual,
-            "unified_confidence_threshold": self.unified_confidence_threshold
-        }
+        detection_config = self._detection_config
+        old_config = asdict(detection_config)
         
         if enable_unified is not None:
-            self.enable_unified_detection = enable_unified
+            detection_config.enable_unified_detection = enable_unified
             
         if enable_fallback is not None:
-            self.fallback_to_individual = enable_fallback
+            detection_config.fallback_to_individual = enable_fallback
             
         if confidence_threshold is not None:
             if 0.0 <= confidence_threshold <= 1.0:
-                self.unified_confidence_threshold = confidence_threshold
+                detection_config.unified_confidence_threshold = confidence_threshold
             else:
                 logger.warning(f"無效的信心度閾值: {confidence_threshold}, 應在 0.0-1.0 之間")
         
-        new_config = {
-            "enable_unified_detection": self.enable_unified_detection,
-            "fallback_to_individual": self.fallback_to_individual,
-            "unified_confidence_threshold": self.unified_confidence_threshold
-        }
+        new_config = asdict(detection_config)
         
         logger.info(f"檢測方法配置已更新: {old_config} -> {new_config}")
         return {
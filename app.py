@@ -1,10 +1,13 @@
 import logging
 from flask import Flask, request
-from application import app
+from application import create_app
 
 # 設置日誌記錄器
 logger = logging.getLogger(__name__)
 
+# 實際提供服務的入口才建立應用程式（執行預熱與路由註冊）
+app = create_app()
+
 if __name__ == "__main__":
     try: 
         app.debug = True
@@ -6,35 +6,60 @@ import os
 
 # 將專案根目錄加入到系統路徑
 
-# 設置日誌記錄
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-
-# 創建 Flask 應用程式實例
-app = Flask(__name__,
-           static_folder=str(Path(__file__).parent.parent / 'static'),
-           template_folder=str(Path(__file__).parent.parent / 'templates'))      # 設定 static 與 templates 資料夾路徑
-
-# 初始化預熱服務
-try:
-    from Service.PrewarmService import initialize_prewarm
-    initialize_prewarm()
-    logging.info("預熱服務已啟動")
-except Exception as e:
-    logging.warning(f"預熱服務啟動失敗: {str(e)}")
-
-# 設定根目錄路由重定向至API
-# @app.route('/')
-# def api_info():
-#     return jsonify({
-#         "status": "success",
-#         "message": "請使用 /api/v1/ 端點訪問API服務"
-#     })
-
-# 初始化路由設定
-from Conrtoller import register_routes
-register_routes(app)
+# 專案根目錄
+_BASE_DIR = Path(__file__).resolve().parent.parent
 
+# 已建立的 Flask 應用程式實例（由 create_app 建立一次後重複使用）
+_app = None
 
+def create_app():
+    """
+    建立並初始化 Flask 應用程式，重複呼叫時返回同一個實例
+    日誌設定、預熱服務與路由註冊都在此執行，只 import 本模組不會觸發這些初始化
+
+    Returns:
+        Flask: 應用程式實例
+    """
+    global _app
+    if _app is not None:
+        return _app
+
+    # 設置日誌記錄
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    # 創建 Flask 應用程式實例
+    app = Flask(__name__,
+               static_folder=str(_BASE_DIR / 'static'),
+               template_folder=str(_BASE_DIR / 'templates'))      # 設定 static 與 templates 資料夾路徑
+
+    # 初始化預熱服務
+    try:
+        from Service.PrewarmService import initialize_prewarm
+        initialize_prewarm()
+        logging.info("預熱服務已啟動")
+    except Exception as e:
+        logging.warning(f"預熱服務啟動失敗: {str(e)}")
+
+    # 設定根目錄路由重定向至API
+    # @app.route('/')
+    # def api_info():
+    #     return jsonify({
+    #         "status": "success",
+    #         "message": "請使用 /api/v1/ 端點訪問API服務"
+    #     })
+
+    # 初始化路由設定
+    from Conrtoller import register_routes
+    register_routes(app)
+
+    _app = app
+    return _app
+
+def __getattr__(name):
+    """相容舊的 `from application import app`：第一次取用 app 時才建立應用程式"""
+    if name == "app":
+        return create_app()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
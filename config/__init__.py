@@ -1,24 +1,29 @@
 import json
 import os
+from functools import lru_cache
 from pathlib import Path
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
 load_dotenv()
 
+from config.settings import settings
+
+CONFIG_PATH = Path(__file__).parent / 'config.json'
+
+@lru_cache(maxsize=1)
 def get_config():
     """
-    載入配置檔案
+    載入配置檔案（只在第一次呼叫時讀取並解析，之後返回同一份快取內容，呼叫端請勿修改）
     
     Returns:
         dict: 配置檔案的內容
     """
-    config_path = Path(__file__).parent / 'config.json'
-    with open(config_path, 'r', encoding='utf-8') as f:
+    with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
         config = json.load(f)
     
     # Override sensitive data with environment variables
     if 'gemini' in config and 'apikey' in config['gemini']:
-        config['gemini']['apikey'] = os.getenv('GEMINI_API_KEY', config['gemini']['apikey'])
+        config['gemini']['apikey'] = settings.gemini_api_key or config['gemini']['apikey']
     
     return config
@@ -3,13 +3,15 @@
 # 專門用於存放資料庫連接配置，避免循環導入問題
 # ==========================================================
 
-import os
+from config.settings import settings
 
 # SQL Server 資料庫連接配置
 db_config = {
     'serverName': 'localhost',
     'databaseName': 'Food',
     'userName': 'sa',
-    'password': os.getenv('PASSWORD'),  # Use environment variable
-    'driver': 'ODBC Driver 18 for SQL Server'
+    'password': settings.db_password,  # Use environment variable
+    'driver': 'ODBC Driver 18 for SQL Server',
+    'poolMinSize': 2,   # 連接池啟動時預先建立的連接數
+    'poolMaxSize': 10   # 連接池最多保留的連接數（同時也是非同步查詢的並行上限）
 }
@@ -1,12 +1,29 @@
 #line config
 
-import os
+from functools import lru_cache
+from config.settings import settings
 
-lineToken = os.getenv('LINETOKEN')    # 從環境變量中獲取 LINE Token 
+lineToken = settings.line_token    # 從環境變量中獲取 LINE Token 
 
 
 getUserProfileUrl = "https://api.line.me/v2/bot/profile/{userId}"
 getGroupProfileUrl = "https://api.line.me/v2/bot/group/{groupId}/summary"
 sendReplyMessageUrl = "https://api.line.me/v2/bot/message/reply"
+sendPushMessageUrl = "https://api.line.me/v2/bot/message/push"
 getContentURL = "https://api-data.line.me/v2/bot/message/{messageId}/content"
+getBotInfoUrl = "https://api.line.me/v2/bot/info"
+
+@lru_cache(maxsize=4096)
+def user_profile_url(user_id):
+    """用戶資料 API 的網址（同一用戶重複查詢時直接使用快取的字串）"""
+    return getUserProfileUrl.format(userId=user_id)
+
+@lru_cache(maxsize=1024)
+def group_profile_url(group_id):
+    """群組資訊 API 的網址"""
+    return getGroupProfileUrl.format(groupId=group_id)
+
+def content_url(message_id):
+    """訊息內容下載網址（訊息ID不會重複，不需要快取）"""
+    return getContentURL.format(messageId=message_id)
 # LINE Bot 配置字典（方便統一管理）
\ No newline at end of file
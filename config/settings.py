@@ -0,0 +1,34 @@
+# ==========================================================
+# 環境變數設定
+# 啟動時讀取一次環境變數（含 .env），之後以唯讀屬性存取
+# ==========================================================
+
+import os
+import logging
+from dataclasses import dataclass
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+@dataclass(frozen=True, slots=True)
+class Settings:
+    """應用程式使用的機密設定，建立後不可修改"""
+    line_token: Optional[str]       # LINETOKEN
+    db_password: Optional[str]      # PASSWORD
+    gemini_api_key: Optional[str]   # GEMINI_API_KEY（未設定時使用 config.json 的 apikey）
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        """從環境變數建立設定，缺少的項目在啟動時記錄警告，而不是等到請求時才失敗"""
+        settings = cls(
+            line_token=os.getenv('LINETOKEN'),
+            db_password=os.getenv('PASSWORD'),
+            gemini_api_key=os.getenv('GEMINI_API_KEY')
+        )
+        missing = [name for name in ('line_token', 'db_password') if not getattr(settings, name)]
+        if missing:
+            logger.warning(f"未設定的環境變數: {', '.join(missing)}")
+        return settings
+
+# 全域設定實例
+settings = Settings.from_env()